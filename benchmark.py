@@ -0,0 +1,682 @@
+'''
+Benchmarks for the slow parts of the game
+Runs headless, and writes the results as JSON so runs on different commits
+can be compared
+Run with: python benchmark.py [--suite map|forests|parallel|memory|entities|saves|draw|engine|all]
+                              [--output results.json] [--compare old_results.json]
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pygame
+from tcod.map import compute_fov
+
+import constants
+import world
+import player
+import parallel
+import saves
+from graphics import SPRITE_FILES, Sprite, SpriteLoader
+from objects import Tree, Wood
+from entities import EntityStore, TYPE_IDS
+
+
+# Turns rested at once in the engine suite
+REST_BENCH_TURNS = 1000
+# Radius of the wider action query in the engine suite, in cells
+ACTION_BENCH_RADIUS = 8
+
+SUITES = ("map", "forests", "parallel", "memory", "entities", "saves", "draw", "engine")
+
+# The inputs fed to GameEngine.handle_input, in the format get_inputs returns
+# Walks away and back, chops whatever is nearby and looks around
+INPUT_SCRIPT = ([{"move_player": (1, 0)}] * 8 +
+                [{"move_player": (0, 1)}] * 8 +
+                [{"toggle_actions": True},
+                 {"move_player": (0, 1)},
+                 {"return": True},
+                 {"toggle_actions": True},
+                 {"toggle_inspect": True},
+                 {"move_player": (-1, 0)},
+                 {"move_player": (0, -1)},
+                 {"toggle_inspect": True}] +
+                [{"move_player": (-1, 0)}] * 8 +
+                [{"move_player": (0, -1)}] * 8)
+
+
+def time_call(function, *args):
+    '''
+    Call a function and return (seconds taken, return value)
+    '''
+    start = time.perf_counter()
+    res = function(*args)
+    return time.perf_counter() - start, res
+
+
+def measure(function, repeats, setup=None):
+    '''
+    Time a function over a number of repeats
+    setup: function, called untimed before each repeat, its return value is
+           passed to the function
+    Returns a dict of the best, mean and median seconds
+    '''
+    times = []
+    for _ in range(repeats):
+        if(setup):
+            seconds, _ = time_call(function, setup())
+        else:
+            seconds, _ = time_call(function)
+        times.append(seconds)
+
+    return {"repeats": repeats,
+            "best": min(times),
+            "mean": statistics.mean(times),
+            "median": statistics.median(times)}
+
+
+def make_result(suite, name, params, timing, **stats):
+    '''
+    Make one benchmark result record
+    '''
+    result = {"suite": suite, "name": name, "params": params}
+    result.update(timing)
+    if(stats):
+        result["stats"] = stats
+    return result
+
+
+def get_map_sizes(scales):
+    '''
+    Get the (width, height) of maps with the given area multipliers of the
+    default map, growing in both directions and keeping the aspect ratio
+    '''
+    sizes = []
+    for scale in scales:
+        side = int(round(scale ** 0.5))
+        sizes.append((constants.MAP_WIDTH * side, constants.MAP_HEIGHT * scale // side))
+    return sizes
+
+
+def forest_stats(game_map):
+    '''
+    Return (tree density, mean tree neighbours per tree) for a generated map
+    '''
+    trees = get_tree_cells(game_map)
+
+    tree_count = int(trees.sum())
+    if(tree_count == 0):
+        return 0.0, 0.0
+
+    neighbors = world.count_neighbors(trees)
+    return tree_count / trees.size, float(neighbors[trees].mean())
+
+
+def get_tree_cells(game_map):
+    '''
+    Return a boolean array of the cells of a map with trees
+    '''
+    object_ids = game_map.object_ids
+    trees = object_ids != world.NO_OBJECT
+    trees[trees] = game_map.entities.types[object_ids[trees]] == TYPE_IDS[Tree]
+    return trees
+
+
+def bench_map(args):
+    '''
+    Time creating empty maps
+    '''
+    results = []
+    for width, height in get_map_sizes(args.scales):
+        timing = measure(lambda: world.Map(width, height, seed=args.seed), args.repeats)
+        results.append(make_result("map", "Map.__init__",
+                                   {"width": width, "height": height}, timing))
+    return results
+
+
+def bench_forests(args):
+    '''
+    Time the forest generators on maps of each size and density
+    '''
+    results = []
+    for width, height in get_map_sizes(args.scales):
+        for density in args.densities:
+            maps = []
+
+            def new_map():
+                maps.append(world.Map(width, height, seed=args.seed))
+                return maps[-1]
+
+            timing = measure(lambda game_map: game_map.generate_forests(density=density),
+                             args.repeats, new_map)
+            tree_density, clustering = forest_stats(maps[-1])
+            results.append(make_result("forests", "Map.generate_forests",
+                                       {"width": width, "height": height, "density": density},
+                                       timing,
+                                       objects=len(maps[-1].entities),
+                                       tree_density=tree_density,
+                                       neighbors=clustering))
+
+        # The original generator only runs at its own density
+        if(width * height <= args.iterative_max_cells):
+            game_map = world.Map(width, height, seed=args.seed)
+            timing = measure(game_map.generate_forests_iterative, 1, lambda: [])
+            tree_density, clustering = forest_stats(game_map)
+            results.append(make_result("forests", "Map.generate_forests_iterative",
+                                       {"width": width, "height": height,
+                                        "density": world.FOREST_DENSITY},
+                                       timing,
+                                       objects=len(game_map.entities),
+                                       tree_density=tree_density,
+                                       neighbors=clustering))
+
+    return results
+
+
+def generate_cells(width, height, seed, workers):
+    '''
+    Generate the terrain and grow the forest cells of a map without creating any
+    objects, the part of generation that runs in the worker processes
+    '''
+    rng = np.random.default_rng(seed)
+    if(workers > 1):
+        terrain = parallel.generate_terrain(seed, (width, height), workers)
+        return parallel.grow_forests(rng, terrain, world.FOREST_DENSITY_VECTORIZED, workers)
+
+    terrain = world.generate_terrain(seed, 0, 0, width, height)
+    rock = terrain == world.TERRAIN_IDS["rock"]
+    trees = (rng.random((width, height)) < world.FOREST_DENSITY_VECTORIZED) & ~rock
+    return world.run_forest_automata(trees, rock)
+
+
+def bench_parallel(args):
+    '''
+    Time generating maps across each number of worker processes, and check
+    the trees come out the same as with the first number of workers
+    '''
+    results = []
+    for width, height in get_map_sizes(args.scales):
+        baselines = {}
+        for workers in args.workers:
+            params = {"width": width, "height": height, "workers": workers}
+            cells = []
+            maps = []
+
+            def generate_map():
+                maps.append(world.Map(width, height, seed=args.seed, workers=workers))
+                maps[-1].generate_forests(workers=workers)
+
+            for name, timing, trees in (
+                    ("terrain + forest cells",
+                     measure(lambda: cells.append(generate_cells(width, height, args.seed,
+                                                                 workers)),
+                             args.repeats),
+                     cells),
+                    ("Map + generate_forests", measure(generate_map, args.repeats),
+                     [game_map.object_ids != world.NO_OBJECT for game_map in maps])):
+                # The first number of workers is the baseline
+                baseline = baselines.setdefault(name, (timing["best"], trees[-1]))
+                results.append(make_result("parallel", name, params, timing,
+                                           speedup=baseline[0] / timing["best"],
+                                           same_as_first=bool(np.array_equal(trees[-1],
+                                                                             baseline[1]))))
+    return results
+
+
+class LegacyDropObject:
+    '''
+    The drop object action as it was before objects were slotted
+    '''
+
+    def __init__(self, location, text, obj_to_drop=None, destroy_self=False):
+        self.location = location
+        self.text = text
+        self.destroy_self = destroy_self
+        self.obj_to_drop = obj_to_drop
+
+
+class LegacyTree:
+    '''
+    A tree as it was before objects were slotted, with everything stored on
+    every tree, to compare memory against
+    '''
+
+    def __init__(self, x, y):
+        self.location = (x, y)
+        self.x_pixel = x * constants.CELL_WIDTH
+        self.y_pixel = y * constants.CELL_HEIGHT
+
+        self.name = "tree"
+        self.color = (0, 255, 0)
+        self.sprite = SpriteLoader.sprites.get("tree")
+        self.transparent = False
+        self.actions = [
+            LegacyDropObject((x, y), "CUT TREE", Wood, destroy_self=True)
+        ]
+
+
+def measure_memory(function):
+    '''
+    Call a function and return (bytes still allocated by it, peak bytes, return value)
+    '''
+    tracemalloc.start()
+    try:
+        res = function()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return current, peak, res
+
+
+def bench_memory(args):
+    '''
+    Measure the memory of the trees of maps of each size, as the game stores
+    them and as they were stored before they were slotted
+    '''
+    results = []
+    for width, height in get_map_sizes(args.scales):
+        params = {"width": width, "height": height}
+        game_map = world.Map(width, height, seed=args.seed)
+        game_map.generate_forests()
+        xs, ys = np.nonzero(get_tree_cells(game_map))
+        cells = list(zip(xs.tolist(), ys.tolist()))
+
+        for name, tree_type in (("Tree objects (per instance dicts)", LegacyTree),
+                                ("Tree objects (slots)", Tree)):
+            def create_trees():
+                return [tree_type(x, y) for x, y in cells]
+
+            current, peak, _ = measure_memory(create_trees)
+            timing = measure(create_trees, args.repeats)
+            results.append(make_result("memory", name, params, timing,
+                                       objects=len(cells),
+                                       bytes=current,
+                                       peak_bytes=peak,
+                                       bytes_per_object=current / max(len(cells), 1)))
+
+        # The same trees as rows of entity columns
+        def create_entities():
+            entities = EntityStore()
+            entities.create_many(Tree, xs, ys)
+            return entities
+
+        current, peak, _ = measure_memory(create_entities)
+        timing = measure(create_entities, args.repeats)
+        results.append(make_result("memory", "Tree entities (EntityStore)", params, timing,
+                                   objects=len(cells),
+                                   bytes=current,
+                                   peak_bytes=peak,
+                                   bytes_per_object=current / max(len(cells), 1)))
+
+        # The whole map, arrays and entities included
+        current, peak, _ = measure_memory(lambda: generate_map(width, height, args.seed))
+        timing = measure(lambda: generate_map(width, height, args.seed), args.repeats)
+        results.append(make_result("memory", "Map + generate_forests", params, timing,
+                                   objects=len(cells), bytes=current, peak_bytes=peak))
+
+    return results
+
+
+def generate_map(width, height, seed):
+    '''
+    Make a map with forests
+    '''
+    game_map = world.Map(width, height, seed=seed)
+    game_map.generate_forests()
+    return game_map
+
+
+def cut_trees(game_map, cells):
+    '''
+    Cut down the trees on every cell into wood, the way the engine handles
+    the response of the cut tree action
+    '''
+    for x, y in cells:
+        game_map.spawn_object(x, y, None)
+        game_map.spawn_object(x, y, Wood)
+
+
+def bench_entities(args):
+    '''
+    Time destroying and creating entities one at a time, and finding every
+    entity of a type at once
+    '''
+    results = []
+    for width, height in get_map_sizes(args.scales):
+        params = {"width": width, "height": height}
+        xs, ys = np.nonzero(get_tree_cells(generate_map(width, height, args.seed)))
+        cells = list(zip(xs.tolist(), ys.tolist()))
+
+        timing = measure(lambda game_map: cut_trees(game_map, cells), args.repeats,
+                         lambda: generate_map(width, height, args.seed))
+        results.append(make_result("entities", "Map.spawn_object (cut every tree)", params,
+                                   timing, objects=len(cells)))
+
+        game_map = generate_map(width, height, args.seed)
+        timing = measure(lambda: game_map.entities.get_ids_of_type(Tree), args.repeats)
+        results.append(make_result("entities", "EntityStore.get_ids_of_type", params, timing,
+                                   objects=len(cells)))
+
+    return results
+
+
+def bench_saves(args):
+    '''
+    Time saving and loading games on maps of each size
+    '''
+    # Imported here so the other suites don't need a display
+    from engine import GameStats
+
+    results = []
+    save_path = os.path.abspath("benchmark_save.npz")
+    for width, height in get_map_sizes(args.scales):
+        params = {"width": width, "height": height}
+        game_map = world.Map(width, height, seed=args.seed)
+        game_map.generate_forests()
+        game_map.explored[:width // 2, :] = True
+        game_player = player.Player(width // 2, height // 2)
+        game_stats = GameStats()
+
+        timing = measure(lambda: saves.save_game(save_path, game_map, game_player, game_stats),
+                         args.repeats)
+        results.append(make_result("saves", "save_game", params, timing,
+                                   objects=len(game_map.entities),
+                                   file_bytes=os.path.getsize(save_path)))
+
+        timing = measure(lambda: saves.load_game(save_path, GameStats()), args.repeats)
+        results.append(make_result("saves", "load_game", params, timing,
+                                   objects=len(game_map.entities)))
+
+    os.remove(save_path)
+    return results
+
+
+def setup_display():
+    '''
+    Open a display and load the sprites
+    '''
+    pygame.init()
+    pygame.display.set_mode((constants.DISPLAY_WIDTH, constants.DISPLAY_HEIGHT))
+    SpriteLoader.load_sprites()
+
+
+def setup_draw_map(seed):
+    '''
+    Make a map with forests and a camera looking at an explored, partly visible area
+    '''
+    game_map = world.Map(constants.MAP_WIDTH, constants.MAP_HEIGHT, seed=seed)
+    game_map.generate_forests()
+
+    camera = world.Camera(0, 0)
+    center = (constants.MAP_WIDTH // 2, constants.MAP_HEIGHT // 2)
+    camera.center_at(center)
+
+    # Everything in view has been explored, only the FOV is visible
+    game_map.explored[:, :] = True
+    game_map.visible[:, :] = compute_fov(game_map.transparency, center,
+                                         radius=constants.FOV_RADIUS,
+                                         algorithm=constants.FOV_ALG)
+
+    return game_map, camera
+
+
+def draw_individually(game_map, surface, camera, sprites):
+    '''
+    Draw the way the game did before the atlas: one blit per tile and per
+    object, from separately loaded sprites that were never converted
+    '''
+    for y in range(camera.location[1] - 1, camera.location[1] + 2 + constants.CAMERA_HEIGHT_CELL):
+        for x in range(camera.location[0] - 1, camera.location[0] + 2 + constants.CAMERA_WIDTH_CELL):
+            if(not game_map.in_bounds(x, y)):
+                continue
+            tile = game_map.get_tile(x, y)
+            if(tile.visible or tile.explored):
+                sprite = sprites[tile.terrain]
+                surface.blit(sprite.image[0] if tile.visible else sprite.fog_image[0],
+                             camera.get_surface_position(tile.location))
+
+    x_start, y_start = camera.location
+    for game_object in game_map.get_objects_in(x_start, y_start,
+                                               x_start + constants.CAMERA_WIDTH_CELL + 2,
+                                               y_start + constants.CAMERA_HEIGHT_CELL + 2):
+        if(game_map.visible[game_object.location] and game_object.name in sprites):
+            surface.blit(sprites[game_object.name].image[0],
+                         camera.get_surface_position(game_object.location))
+
+
+def bench_draw(args):
+    '''
+    Time drawing the map and objects per frame, individually and batched
+    '''
+    setup_display()
+    game_map, camera = setup_draw_map(args.seed)
+    surface = pygame.Surface(camera.get_rect().size)
+    unpacked_sprites = {name: Sprite(file_path) for name, file_path in SPRITE_FILES.items()}
+
+    def draw_batched():
+        game_map.draw(surface, camera)
+        game_map.draw_objects(surface, camera)
+
+    results = []
+    for name, draw in (("individual blits", lambda: draw_individually(game_map, surface,
+                                                                      camera, unpacked_sprites)),
+                       ("atlas + blits()", draw_batched)):
+        # Warm up once before timing
+        draw()
+        timing = measure(draw, args.frames)
+        results.append(make_result("draw", name,
+                                   {"width": game_map.width, "height": game_map.height},
+                                   timing))
+
+    return results
+
+
+def new_engine(width, height, density, seed):
+    '''
+    Make a game engine ready for its first frame, without starting its loop
+    '''
+    # Imported here so the other suites don't need a display
+    from engine import GameEngine
+
+    GameEngine.state = "GAMEPLAY"
+    game_engine = GameEngine(map_size=(width, height), seed=seed)
+    game_engine.setup(forest_density=density)
+    return game_engine
+
+
+def run_input_script(game_engine):
+    '''
+    Feed the input script to an engine
+    '''
+    for inputs in INPUT_SCRIPT:
+        game_engine.handle_input(inputs)
+
+
+def bench_engine(args):
+    '''
+    Time the engine's per frame and per turn work on maps of each size and density
+    '''
+    results = []
+    for width, height in get_map_sizes(args.scales):
+        for density in args.densities:
+            params = {"width": width, "height": height, "density": density}
+            game_engine = new_engine(width, height, density, args.seed)
+            objects = len(game_engine.map.entities) + len(game_engine.objects)
+
+            def redraw_all():
+                game_engine.redraw_all = True
+
+            # Draw the first frame before timing
+            game_engine.draw()
+
+            timings = [
+                ("GameEngine.update_fov", measure(game_engine.update_fov, args.frames)),
+                ("GameEngine.update_fov (uncached)",
+                 measure(lambda _: game_engine.update_fov(), args.frames,
+                         game_engine.map.fov_cache.clear)),
+                ("GameEngine.draw", measure(game_engine.draw, args.frames)),
+                ("GameEngine.draw (full)", measure(lambda _: game_engine.draw(),
+                                                   args.frames, redraw_all)),
+                ("player.get_nearby_actions",
+                 measure(lambda: player.get_nearby_actions(game_engine.player,
+                                                           game_engine.map),
+                         args.frames)),
+                ("ActionIndex.query (radius " + str(ACTION_BENCH_RADIUS) + ")",
+                 measure(lambda: game_engine.map.action_index.query(
+                             game_engine.player.location, ACTION_BENCH_RADIUS),
+                         args.frames)),
+                ("GameEngine.increment_turn (rest " + str(REST_BENCH_TURNS) + ")",
+                 measure(lambda: game_engine.increment_turn(REST_BENCH_TURNS), args.repeats)),
+                ("GameEngine.handle_input x " + str(len(INPUT_SCRIPT)),
+                 measure(run_input_script, args.repeats,
+                         lambda: new_engine(width, height, density, args.seed)))
+            ]
+
+            # Time the frame again with its phases being timed, for the profiler's overhead
+            game_engine.enable_profiler()
+            timings.append(("GameEngine.draw (profiled)",
+                            measure(game_engine.draw, args.frames)))
+
+            for name, timing in timings:
+                results.append(make_result("engine", name, params, timing, objects=objects))
+
+    return results
+
+
+def get_commit():
+    '''
+    Get the git commit the benchmarks ran on, or None outside of a git checkout
+    '''
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_result_key(result):
+    '''
+    Get the key results are matched on between runs
+    '''
+    return (result["suite"], result["name"], json.dumps(result["params"], sort_keys=True))
+
+
+def format_params(params):
+    '''
+    Format a result's params for the table
+    '''
+    text = ""
+    if("width" in params):
+        text = str(params["width"]) + "x" + str(params["height"])
+    if("density" in params):
+        text += " d=" + format(params["density"], "g")
+    if("workers" in params):
+        text += " w=" + str(params["workers"])
+    return text
+
+
+def print_results(results, baseline=None):
+    '''
+    Print a table of results, and how they compare to a baseline run if given
+    '''
+    baseline_results = {}
+    if(baseline):
+        baseline_results = {get_result_key(res): res for res in baseline["results"]}
+
+    print("{:<8} {:<34} {:<18} {:>12} {:>12} {:>8} {:>10}".format(
+        "suite", "name", "params", "best ms", "mean ms", "change", "KiB"))
+    for res in results:
+        change = ""
+        old_res = baseline_results.get(get_result_key(res))
+        if(old_res and old_res["best"] > 0):
+            change = format(res["best"] / old_res["best"] - 1, "+.0%")
+
+        memory = ""
+        if("bytes" in res.get("stats", {})):
+            memory = str(res["stats"]["bytes"] // 1024)
+
+        print("{:<8} {:<34} {:<18} {:>12.3f} {:>12.3f} {:>8} {:>10}".format(
+            res["suite"], res["name"], format_params(res["params"]),
+            res["best"] * 1000, res["mean"] * 1000, change, memory))
+
+
+def main():
+    '''
+    Run the benchmarks, print a table of results and write them as JSON
+    '''
+    parser = argparse.ArgumentParser(description="Benchmark the game")
+    parser.add_argument("--suite", choices=SUITES + ("all",), nargs="+", default=["all"])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4],
+                        help="map area multipliers of the default map size")
+    parser.add_argument("--densities", type=float, nargs="+", default=[0.2, 0.27, 0.45],
+                        help="forest seed densities")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted(set([1, 2, 4, os.cpu_count() or 1])),
+                        help="worker process counts of the parallel benchmarks, the first is the baseline")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="repeats of the slow benchmarks")
+    parser.add_argument("--frames", type=int, default=100,
+                        help="repeats of the per frame benchmarks")
+    parser.add_argument("--iterative-max-cells", type=int, default=constants.MAP_WIDTH *
+                        constants.MAP_HEIGHT,
+                        help="skip the iterative forest generator on bigger maps")
+    parser.add_argument("--output", default="benchmark_results.json",
+                        help="file the JSON results are written to")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare to")
+    args = parser.parse_args()
+
+    # Run headless unless a video driver was chosen
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+    baseline = None
+    if(args.compare):
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    # Sprites and fonts are loaded relative to the game's directory
+    output = os.path.abspath(args.output)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    suites = SUITES if "all" in args.suite else args.suite
+    benchmarks = {"map": bench_map, "forests": bench_forests,
+                  "parallel": bench_parallel, "memory": bench_memory,
+                  "entities": bench_entities, "saves": bench_saves,
+                  "draw": bench_draw, "engine": bench_engine}
+
+    # Keep the results of the suites that finished, even if a later one fails
+    results = []
+    try:
+        for suite in suites:
+            results.extend(benchmarks[suite](args))
+    finally:
+        print_results(results, baseline)
+        write_results(output, args, results)
+
+
+def write_results(output, args, results):
+    '''
+    Write the results as JSON, with the commit and versions they ran on
+    '''
+    with open(output, "w") as output_file:
+        json.dump({"commit": get_commit(),
+                   "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                   "python": sys.version.split()[0],
+                   "pygame": pygame.version.ver,
+                   "numpy": np.__version__,
+                   "platform": platform.platform(),
+                   "args": vars(args),
+                   "results": results},
+                  output_file, indent=2)
+    print("Results written to " + output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+'''
+The chunks module holds a map split into square chunks, which are generated
+the first time they are needed and evicted to disk when too many are in memory
+'''
+import operator
+import os
+import tempfile
+from collections import OrderedDict
+import numpy as np
+
+import constants
+import world
+from objects import Tree
+from entities import ENTITY_TYPES, TYPE_IDS_BY_NAME
+
+
+# Every per cell layer a chunk stores, and its dtype
+LAYERS = {
+    "terrain": np.uint8,
+    "transparent": bool,
+    "transparency": bool,
+    "visible": bool,
+    "explored": bool,
+    "object_ids": np.int32
+}
+
+# Layers written to disk when a chunk is evicted, the rest are rebuilt on load
+SAVED_LAYERS = ("terrain", "transparent", "visible", "explored")
+
+
+class Chunk:
+    '''
+    A square block of CHUNK_SIZE x CHUNK_SIZE map cells
+    '''
+
+    def __init__(self, key, layers):
+        self.key = key
+        self.layers = layers
+        # If this chunk changed since it was generated or loaded
+        self.dirty = False
+
+
+class ChunkedLayer:
+    '''
+    One layer of a ChunkedMap, indexed like an array with [x, y] or
+    [x_start:x_end, y_start:y_end]
+    '''
+
+    def __init__(self, game_map, name):
+        self.map = game_map
+        self.name = name
+        self.dtype = np.dtype(LAYERS[name])
+        self.shape = (game_map.width, game_map.height)
+
+    def __getitem__(self, key):
+        x_bounds, y_bounds = self.get_bounds(key)
+
+        # Fast path for a single cell
+        if(x_bounds[2] and y_bounds[2]):
+            chunk = self.map.get_chunk(x_bounds[0] // constants.CHUNK_SIZE,
+                                       y_bounds[0] // constants.CHUNK_SIZE)
+            return chunk.layers[self.name][x_bounds[0] % constants.CHUNK_SIZE,
+                                           y_bounds[0] % constants.CHUNK_SIZE]
+
+        res = np.empty((x_bounds[1] - x_bounds[0], y_bounds[1] - y_bounds[0]),
+                       dtype=self.dtype)
+        for chunk, chunk_area, res_area in self.map.chunks_in(x_bounds[0], y_bounds[0],
+                                                              x_bounds[1], y_bounds[1]):
+            res[res_area] = chunk.layers[self.name][chunk_area]
+
+        return self.squeeze(res, x_bounds, y_bounds)
+
+    def __setitem__(self, key, value):
+        x_bounds, y_bounds = self.get_bounds(key)
+
+        # Fast path for a single cell
+        if(x_bounds[2] and y_bounds[2]):
+            chunk = self.map.get_chunk(x_bounds[0] // constants.CHUNK_SIZE,
+                                       y_bounds[0] // constants.CHUNK_SIZE)
+            chunk.layers[self.name][x_bounds[0] % constants.CHUNK_SIZE,
+                                    y_bounds[0] % constants.CHUNK_SIZE] = value
+            chunk.dirty = True
+            return
+
+        shape = (x_bounds[1] - x_bounds[0], y_bounds[1] - y_bounds[0])
+
+        # Broadcast the value against the shape the key would read back
+        value = np.asarray(value, dtype=self.dtype)
+        value = np.broadcast_to(value, self.squeeze(np.empty(shape), x_bounds, y_bounds).shape)
+        value = value.reshape(shape)
+
+        # Only chunks whose cells change need writing back to disk
+        for chunk, chunk_area, res_area in self.map.chunks_in(x_bounds[0], y_bounds[0],
+                                                              x_bounds[1], y_bounds[1]):
+            layer = chunk.layers[self.name]
+            if(not np.array_equal(layer[chunk_area], value[res_area])):
+                layer[chunk_area] = value[res_area]
+                chunk.dirty = True
+
+    def get_bounds(self, key):
+        '''
+        Turn an [x, y] key into ((x_start, x_end, is_int), (y_start, y_end, is_int))
+        '''
+        if(not isinstance(key, tuple) or len(key) != 2):
+            raise IndexError("ChunkedLayer must be indexed with [x, y]")
+
+        return (get_axis_bounds(key[0], self.shape[0]),
+                get_axis_bounds(key[1], self.shape[1]))
+
+    @staticmethod
+    def squeeze(res, x_bounds, y_bounds):
+        '''
+        Drop the axes of res that were indexed by a single int
+        '''
+        if(x_bounds[2]):
+            res = res[0]
+            return res[0] if y_bounds[2] else res
+        if(y_bounds[2]):
+            return res[:, 0]
+        return res
+
+
+class ChunkGenerator:
+    '''
+    Generates the chunks of a map from its seed, for maps that fill their
+    layers a chunk at a time
+    A chunk comes out the same whichever map generates it, or in whatever
+    order the chunks are generated
+    '''
+
+    def _init_generation(self):
+        '''
+        Start out without forests, until generate_forests is called
+        '''
+        # Forests grow on chunks once generate_forests has been called
+        self.forests = False
+        self.forest_density = world.FOREST_DENSITY_VECTORIZED
+
+    def generate_forests(self, objects=None, density=world.FOREST_DENSITY_VECTORIZED, workers=1):
+        '''
+        Grow forests on every chunk generated from now on
+        Call this before the map is used
+        density: float, chance of each cell starting with a tree
+        workers: int, unused, chunks are generated one at a time as they are needed
+        '''
+        self.forests = True
+        self.forest_density = density
+
+    def generate_chunk(self, chunk_x, chunk_y):
+        '''
+        Generate a chunk from the seed
+        '''
+        size = constants.CHUNK_SIZE
+        terrain, seed_trees, outside = self.get_chunk_base(chunk_x, chunk_y)
+
+        layers = {
+            "terrain": terrain,
+            "transparent": world.TERRAIN_TRANSPARENCY[terrain],
+            "visible": np.zeros((size, size), dtype=bool),
+            "explored": np.zeros((size, size), dtype=bool),
+            "object_ids": np.full((size, size), world.NO_OBJECT, dtype=LAYERS["object_ids"])
+        }
+        layers["transparency"] = layers["transparent"].copy()
+
+        if(self.forests):
+            # The automata only reads cells FOREST_PASSES away, so running it
+            # over the chunk plus that margin from its neighbours gives the
+            # same trees as running it over the whole world
+            margin = world.FOREST_PASSES
+            rock = np.empty((size * 3, size * 3), dtype=bool)
+            trees = np.empty((size * 3, size * 3), dtype=bool)
+            for x_offset in range(3):
+                for y_offset in range(3):
+                    if(x_offset == 1 and y_offset == 1):
+                        base = (terrain, seed_trees, outside)
+                    else:
+                        base = self.get_chunk_base(chunk_x + x_offset - 1,
+                                                   chunk_y + y_offset - 1)
+                    area = (slice(x_offset * size, (x_offset + 1) * size),
+                            slice(y_offset * size, (y_offset + 1) * size))
+                    # Cells outside the world can never hold trees
+                    rock[area] = (base[0] == world.TERRAIN_IDS["rock"]) | base[2]
+                    trees[area] = base[1] & ~rock[area]
+
+            window = slice(size - margin, size * 2 + margin)
+            trees = world.run_forest_automata(trees[window, window], rock[window, window])
+            trees = trees[margin:margin + size, margin:margin + size]
+
+            self.add_chunk_objects(layers, (chunk_x, chunk_y), Tree, *np.nonzero(trees))
+
+        return Chunk((chunk_x, chunk_y), layers)
+
+    def get_chunk_base(self, chunk_x, chunk_y):
+        '''
+        Get the terrain, seed trees and outside-the-world mask of a chunk
+        These only depend on the seed and the chunk's key
+        '''
+        size = constants.CHUNK_SIZE
+
+        # Chunks entirely outside the world
+        if(chunk_x < 0 or chunk_y < 0 or
+           chunk_x * size >= self.width or chunk_y * size >= self.height):
+            return (np.full((size, size), world.TERRAIN_IDS["rock"], dtype=np.uint8),
+                    np.zeros((size, size), dtype=bool),
+                    np.ones((size, size), dtype=bool))
+
+        # Terrain comes from noise over the whole world, so it lines up between chunks
+        terrain = world.generate_terrain(self.seed, chunk_x * size, chunk_y * size, size, size)
+        rng = np.random.default_rng([self.seed, chunk_x, chunk_y])
+        seed_trees = rng.random((size, size)) < self.forest_density
+
+        # Cells past the right or bottom edge of the world
+        cells = np.arange(size)
+        outside = (((chunk_x * size + cells) >= self.width)[:, np.newaxis] |
+                   ((chunk_y * size + cells) >= self.height)[np.newaxis, :])
+
+        return terrain, seed_trees, outside
+
+    def add_chunk_objects(self, layers, key, object_type, xs, ys):
+        '''
+        Create an entity of an object type on each of many cells of a chunk's layers
+        key: (chunk x, chunk y) of the chunk
+        xs, ys: arrays, the chunk cell of each entity
+        The FOV cache is left alone, as these objects are the ones the chunk has always had
+        '''
+        layers["object_ids"][xs, ys] = self.entities.create_many(
+            object_type, key[0] * constants.CHUNK_SIZE + xs, key[1] * constants.CHUNK_SIZE + ys)
+
+        if(object_type.transparent is False):
+            layers["transparency"][xs, ys] = False
+
+
+class ChunkedMap(ChunkGenerator, world.Map):
+    '''
+    A map made up of chunks that are generated as they are first used, so the
+    world can be far bigger than what is kept in memory
+    The least recently used chunks are evicted to disk past the cache size
+    '''
+
+    def __init__(self, width, height, seed=None,
+                 cache_size=constants.CHUNK_CACHE_SIZE, cache_dir=None):
+        self.width = width
+        self.height = height
+
+        # Every chunk is generated from the seed and its own key
+        self._init_indexes(seed)
+        self._init_generation()
+
+        # Resident chunks by (chunk x, chunk y), least recently used first
+        self.chunks = OrderedDict()
+        self.cache_size = max(cache_size, 4)
+
+        # Directory evicted chunks are written to
+        self.temp_dir = None
+        if(cache_dir is None):
+            self.temp_dir = tempfile.TemporaryDirectory(prefix="tile-game-chunks-")
+            cache_dir = self.temp_dir.name
+        self.cache_dir = cache_dir
+
+        # Per cell state, indexed [x, y] like the arrays of a Map
+        self.terrain = ChunkedLayer(self, "terrain")
+        self.transparent = ChunkedLayer(self, "transparent")
+        self.transparency = ChunkedLayer(self, "transparency")
+        self.visible = ChunkedLayer(self, "visible")
+        self.explored = ChunkedLayer(self, "explored")
+        self.object_ids = ChunkedLayer(self, "object_ids")
+
+    def stream(self, location):
+        '''
+        Make sure every chunk within CHUNK_STREAM_RADIUS of location is resident
+        '''
+        radius = constants.CHUNK_STREAM_RADIUS
+        x_start = max(location[0] - radius, 0)
+        y_start = max(location[1] - radius, 0)
+        x_end = min(location[0] + radius + 1, self.width)
+        y_end = min(location[1] + radius + 1, self.height)
+
+        for _ in self.chunks_in(x_start, y_start, x_end, y_end):
+            pass
+
+    def chunks_in(self, x_start, y_start, x_end, y_end):
+        '''
+        Yield (chunk, area in chunk, area in rectangle) for every chunk
+        overlapping the given cell rectangle
+        '''
+        size = constants.CHUNK_SIZE
+        if(x_end <= x_start or y_end <= y_start):
+            return
+
+        for chunk_y in range(y_start // size, (y_end - 1) // size + 1):
+            for chunk_x in range(x_start // size, (x_end - 1) // size + 1):
+                chunk = self.get_chunk(chunk_x, chunk_y)
+
+                # Overlap of the chunk and the rectangle, in cells
+                left = max(x_start, chunk_x * size)
+                right = min(x_end, (chunk_x + 1) * size)
+                top = max(y_start, chunk_y * size)
+                bottom = min(y_end, (chunk_y + 1) * size)
+
+                yield (chunk,
+                       (slice(left - chunk_x * size, right - chunk_x * size),
+                        slice(top - chunk_y * size, bottom - chunk_y * size)),
+                       (slice(left - x_start, right - x_start),
+                        slice(top - y_start, bottom - y_start)))
+
+    def get_chunk(self, chunk_x, chunk_y):
+        '''
+        Get a chunk, loading or generating it if it is not resident
+        '''
+        key = (chunk_x, chunk_y)
+        chunk = self.chunks.get(key)
+
+        if(chunk):
+            self.chunks.move_to_end(key)
+            return chunk
+
+        chunk = self.load_chunk(chunk_x, chunk_y)
+        if(not chunk):
+            chunk = self.generate_chunk(chunk_x, chunk_y)
+        self.chunks[key] = chunk
+
+        # Evict the least recently used chunks past the cache size
+        while(len(self.chunks) > self.cache_size):
+            self.evict_chunk()
+
+        return chunk
+
+    def evict_chunk(self):
+        '''
+        Evict the least recently used chunk, writing it to disk if it changed
+        '''
+        _, chunk = self.chunks.popitem(last=False)
+
+        if(chunk.dirty):
+            self.save_chunk(chunk)
+
+        # Forget the chunk's objects
+        object_ids = chunk.layers["object_ids"]
+        self.entities.destroy_many(object_ids[object_ids != world.NO_OBJECT])
+
+    def get_chunk_path(self, chunk_x, chunk_y):
+        '''
+        Get the file path an evicted chunk is stored at
+        '''
+        return os.path.join(self.cache_dir,
+                            "chunk_" + str(chunk_x) + "_" + str(chunk_y) + ".npz")
+
+    def save_chunk(self, chunk):
+        '''
+        Write a chunk's layers and objects to disk
+        '''
+        object_ids = chunk.layers["object_ids"]
+        object_x, object_y = np.nonzero(object_ids != world.NO_OBJECT)
+        object_names = [ENTITY_TYPES[type_id].name for type_id in
+                        self.entities.types[object_ids[object_x, object_y]].tolist()]
+
+        with open(self.get_chunk_path(*chunk.key), "wb") as chunk_file:
+            np.savez(chunk_file,
+                     object_x=object_x,
+                     object_y=object_y,
+                     object_names=np.array(object_names, dtype=str),
+                     **{name: chunk.layers[name] for name in SAVED_LAYERS})
+
+    def load_chunk(self, chunk_x, chunk_y):
+        '''
+        Load a previously evicted chunk from disk, None if it was never saved
+        '''
+        path = self.get_chunk_path(chunk_x, chunk_y)
+        if(not os.path.exists(path)):
+            return None
+
+        with np.load(path) as data:
+            layers = {name: data[name] for name in SAVED_LAYERS}
+            layers["transparency"] = layers["transparent"].copy()
+            layers["object_ids"] = np.full(layers["terrain"].shape, world.NO_OBJECT,
+                                           dtype=LAYERS["object_ids"])
+
+            # Recreate the objects, a type at a time
+            object_x = data["object_x"]
+            object_y = data["object_y"]
+            object_names = data["object_names"]
+            for name in np.unique(object_names).tolist():
+                is_type = object_names == name
+                self.add_chunk_objects(layers, (chunk_x, chunk_y),
+                                       ENTITY_TYPES[TYPE_IDS_BY_NAME[name]],
+                                       object_x[is_type], object_y[is_type])
+
+        return Chunk((chunk_x, chunk_y), layers)
+
+
+def get_axis_bounds(index, size):
+    '''
+    Turn an int or slice index along an axis of the given size into
+    (start, end, is_int)
+    '''
+    if(isinstance(index, slice)):
+        start, end, step = index.indices(size)
+        if(step != 1):
+            raise IndexError("ChunkedLayer slices can not have a step")
+        return start, max(start, end), False
+
+    index = operator.index(index)
+    if(index < 0):
+        index += size
+    if(index < 0 or index >= size):
+        raise IndexError("Index out of bounds for axis of size " + str(size))
+    return index, index + 1, True
@@ -14,6 +14,9 @@ CAMERA_HEIGHT = DISPLAY_HEIGHT
 # SIZES OF THINGS IN CELLS
 MAP_WIDTH = 64
 MAP_HEIGHT = 1024
+CHUNKED_MAP_HEIGHT = 1 << 24
+MAPPED_MAP_WIDTH = 4096
+MAPPED_MAP_HEIGHT = 65536
 DISPLAY_WIDTH_CELL = DISPLAY_WIDTH // CELL_WIDTH
 DISPLAY_HEIGHT_CELL = DISPLAY_HEIGHT // CELL_HEIGHT
 CAMERA_WIDTH_CELL = CAMERA_WIDTH // CELL_WIDTH
@@ -22,6 +25,32 @@ CAMERA_HEIGHT_CELL = CAMERA_HEIGHT // CELL_HEIGHT
 # FOV
 FOV_RADIUS = 20  # IN CELLS
 FOV_ALG = FOV_SHADOW
+FOV_CACHE_SIZE = 256  # IN CACHED RESULTS
 
 # TIMES
 MINUTES_PER_TURN = 5
+REST_TURNS = 12  # TURNS RESTED AT ONCE
+
+# CHUNKS
+CHUNK_SIZE = 64  # IN CELLS
+CHUNK_CACHE_SIZE = 16  # CHUNKS KEPT IN MEMORY BEFORE EVICTING TO DISK
+CHUNK_STREAM_RADIUS = 48  # IN CELLS AROUND THE PLAYER
+
+# SPATIAL INDEX
+SPATIAL_BUCKET_SIZE = 8  # IN CELLS
+
+# NEARBY ACTIONS
+NEARBY_ACTIONS_RADIUS = 1  # IN CELLS AROUND THE PLAYER
+
+# SAVES
+SAVE_PATH = "savegame.npz"
+
+# PROFILER
+PROFILE_PATH = "profile.csv"
+PROFILE_WINDOW = 150  # IN FRAMES THE PERCENTILES ARE TAKEN OVER
+PROFILE_FLUSH_FRAMES = 150  # IN FRAMES BETWEEN CSV WRITES
+PROFILE_OVERLAY_FRAMES = 15  # IN FRAMES BETWEEN OVERLAY UPDATES
+
+# MAIN LOOP
+FRAMES_PER_SECOND = 15
+EVENT_WAIT_TIMEOUT = 1000  # IN MILLISECONDS, HOW LONG THE EVENT DRIVEN LOOP BLOCKS
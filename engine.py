@@ -1,15 +1,24 @@
 '''
 Engine handles initializing, starting, looping, and closing the game
 '''
+import argparse
+import os
 import sys
-import pygame
+import time
 import numpy as np
+import pygame
 from tcod.map import compute_fov
 
 import constants
 import world
+import chunks
+import mapped
 import player
 import hud
+import fov
+import saves
+from replay import InputRecorder, Recording
+from profiler import FrameProfiler
 from graphics import SpriteLoader
 from util import clamp
 
@@ -24,6 +33,107 @@ class GameStats:
         self.time = (12, 00)
         self.date = (8, "January")
 
+    def add_minutes(self, minutes):
+        '''
+        Move the time of day forward, wrapping around at midnight
+        '''
+        minutes = (self.time[0] * 60 + self.time[1] + minutes) % (24 * 60)
+        self.time = (minutes // 60, minutes % 60)
+
+
+class TurnScheduler:
+    '''
+    Runs simulation turns apart from the frames that show them
+    Turns are queued as inputs ask for them and run in one batch, so whatever
+    shows the world only has to be refreshed once per batch
+    '''
+
+    def __init__(self, game_stats):
+        self.game_stats = game_stats
+        # Turns queued but not run yet
+        self.pending = 0
+        # Called with the turn number once every turn, in order
+        self.systems = []
+
+    def schedule(self, turns=1):
+        '''
+        Queue turns to be run
+        '''
+        self.pending += turns
+
+    def add_system(self, system):
+        '''
+        Run a callable every turn, given the number of the turn
+        '''
+        self.systems.append(system)
+
+    def run(self):
+        '''
+        Run every queued turn
+        The time of day is moved forward once, after the last turn
+        Returns the number of turns run
+        '''
+        turns = self.pending
+        self.pending = 0
+
+        for _ in range(turns):
+            self.game_stats.turn_count += 1
+            for system in self.systems:
+                system(self.game_stats.turn_count)
+
+        self.game_stats.add_minutes(turns * constants.MINUTES_PER_TURN)
+        return turns
+
+
+# Posted by a timer so the event driven loop never blocks forever
+TICK_EVENT = pygame.USEREVENT + 1
+
+
+class LoopStats:
+    '''
+    LoopStats counts the frames the main loop drew and skipped, and the CPU it used
+    '''
+
+    def __init__(self):
+        self.frames_drawn = 0
+        self.frames_skipped = 0
+
+        # Totals since the loop started
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+        # Totals spent blocked waiting for events
+        self.idle_wall = 0.0
+        self.idle_cpu = 0.0
+        self.idle_start = None
+
+    def start_idle(self):
+        '''
+        Mark the loop as starting to wait for events
+        '''
+        self.idle_start = (time.perf_counter(), time.process_time())
+
+    def end_idle(self):
+        '''
+        Mark the loop as done waiting for events
+        '''
+        self.idle_wall += time.perf_counter() - self.idle_start[0]
+        self.idle_cpu += time.process_time() - self.idle_start[1]
+
+    def report(self):
+        '''
+        Get a summary of the loop's frames and CPU usage
+        '''
+        wall = max(time.perf_counter() - self.wall_start, 1e-9)
+        cpu = time.process_time() - self.cpu_start
+        idle_usage = self.idle_cpu / self.idle_wall if self.idle_wall else 0.0
+
+        return ("Frames drawn: " + str(self.frames_drawn) +
+                ", skipped: " + str(self.frames_skipped) +
+                ", CPU usage: " + format(cpu / wall, ".1%") +
+                ", idle CPU usage: " + format(idle_usage, ".1%") +
+                " over " + format(self.idle_wall, ".1f") + "s idle")
+
 
 class GameEngine:
     '''
@@ -31,18 +141,26 @@ class GameEngine:
     '''
     state = "GAMEPLAY"
 
-    def __init__(self):
+    def __init__(self, chunked_world=False, map_size=None, seed=None, mapped_world=False,
+                 workers=1, headless=False):
         '''
         Loads all the game modules required
+        chunked_world: bool, use a ChunkedMap of CHUNKED_MAP_HEIGHT instead of a Map
+        map_size: tuple (int, int), the (width, height) of the map in cells
+        seed: int, the seed the map is generated from, random if None
+        mapped_world: bool, use a MappedMap of MAPPED_MAP_WIDTH x MAPPED_MAP_HEIGHT
+                      instead of a Map
+        workers: int, processes to generate a Map across
+        headless: bool, run the game without a display, fonts or sprites, so
+                  inputs can be handled but nothing can be drawn
         '''
         # Quit flag
         self.quit_game = False
+        self.headless = headless
 
         # Start pygame
-        pygame.init()
-
-        # Load Sprites
-        SpriteLoader.load_sprites()
+        if(not headless):
+            pygame.init()
 
         # Create player variable
         self.player = None
@@ -50,48 +168,90 @@ class GameEngine:
         # Create game stats
         self.game_stats = GameStats()
 
+        # Runs the turns inputs ask for
+        self.scheduler = TurnScheduler(self.game_stats)
+
         # Create Player Info hud
         self.player_info = hud.hud_PlayerInfoPanel(
             constants.DISPLAY_WIDTH // 5,
-            constants.DISPLAY_HEIGHT // 3)
+            constants.DISPLAY_HEIGHT // 3,
+            (0, 0),
+            headless)
 
         # Nearby actions hud
         self.nearby_actions = hud.hud_NearbyActionsPanel(
             constants.DISPLAY_WIDTH // 5,
-            (constants.DISPLAY_HEIGHT * 2) // 3)
+            (constants.DISPLAY_HEIGHT * 2) // 3,
+            ((constants.DISPLAY_WIDTH * 4) // 5, constants.DISPLAY_HEIGHT // 3),
+            headless)
 
         # Inspection panel hud
         self.inspection_panel = hud.hud_InspectionPanel(
             constants.DISPLAY_WIDTH // 5,
-            constants.DISPLAY_HEIGHT // 3)
+            constants.DISPLAY_HEIGHT // 3,
+            ((constants.DISPLAY_WIDTH * 4) // 5, 0),
+            headless)
 
         # Cursor reference
         self.i_cursor = self.inspection_panel.cursor
 
+        # Create the map
+        self.chunked_world = chunked_world
+        self.mapped_world = mapped_world
+        if(mapped_world):
+            map_size = map_size or (constants.MAPPED_MAP_WIDTH, constants.MAPPED_MAP_HEIGHT)
+            self.map = mapped.MappedMap(map_size[0], map_size[1], seed=seed)
+        elif(chunked_world):
+            map_size = map_size or (constants.MAP_WIDTH, constants.CHUNKED_MAP_HEIGHT)
+            self.map = chunks.ChunkedMap(map_size[0], map_size[1], seed=seed)
+        else:
+            map_size = map_size or (constants.MAP_WIDTH, constants.MAP_HEIGHT)
+            self.map = world.Map(map_size[0], map_size[1], seed=seed, workers=workers)
+        self.workers = workers
+
         # Create the camera
-        self.camera = world.Camera(0, 0)
-
-        # Create the main game surface
-        self.surface_main = pygame.display.set_mode((constants.DISPLAY_WIDTH,
-                                                     constants.DISPLAY_HEIGHT))
-        # Create the map surface
-        self.surface_map = pygame.Surface((constants.MAP_WIDTH * constants.CELL_WIDTH,
-                                           constants.MAP_HEIGHT * constants.CELL_HEIGHT))
-        # Create the hud surface
-        self.surface_hud = pygame.Surface((constants.DISPLAY_WIDTH,
-                                           constants.DISPLAY_HEIGHT))
+        self.camera = world.Camera(0, 0, self.map.width, self.map.height)
+
+        # Create the main game surface and the map surface, only as big as the
+        # camera's view, unless nothing will be drawn
+        self.surface_main = None
+        self.surface_map = None
+        if(not headless):
+            self.surface_main = pygame.display.set_mode((constants.DISPLAY_WIDTH,
+                                                         constants.DISPLAY_HEIGHT))
+
+            # Load Sprites, once the display's pixel format is known
+            SpriteLoader.load_sprites()
+
+            self.surface_map = pygame.Surface(self.camera.get_rect().size)
+
+        # Screen area the map is shown in, between the huds
+        self.map_rect = pygame.Rect(constants.DISPLAY_WIDTH // 5, 0,
+                                    constants.CAMERA_WIDTH, constants.CAMERA_HEIGHT)
+        # Set when the whole screen has to be drawn again
+        self.redraw_all = True
         # Create the pygame clock
         self.clock = pygame.time.Clock()
 
-        # Create the map
-        self.map = world.Map(constants.MAP_WIDTH, constants.MAP_HEIGHT)
-
-        # Create the object container
-        self.objects = []
+        # The map's index of the game objects not occupying a cell
+        self.objects = self.map.objects
 
         # Active action reference
         self.active_action = None
 
+        # Cells the last FOV was computed over, and the (xs, ys) of the cells
+        # whose visibility it changed
+        self.fov_box = None
+        self.fov_changed = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp))
+
+        # Times the phases of every frame when enabled, and its overlay
+        self.profiler = FrameProfiler()
+        self.profiler_panel = None
+
+        # Records the inputs of every frame when set, and the file it is saved to
+        self.recorder = None
+        self.record_path = None
+
     def handle_action_response(self, response):
         '''
         Handle an action response
@@ -99,150 +259,182 @@ class GameEngine:
 
         # Get the location
         location = response.get("location")
-        tile = self.map.tiles[location[0]][location[1]]
 
         # Check response
         if(response.get("success")):
             # Check for destroy self flag
             if(response.get("destroy_self")):
-                obj_to_destroy = tile.contains_obj
-                tile.contains_obj = None
-                self.objects.remove(obj_to_destroy)
+                self.map.set_object(location[0], location[1], None)
 
             # Check for spawned objects flag
-            for obj in response.get("spawned_objects"):
-                self.objects.append(obj)
-                self.map.tiles[obj.location[0]
-                               ][obj.location[1]].contains_obj = obj
+            for object_type, spawn_location in response.get("spawned_objects"):
+                self.map.spawn_object(spawn_location[0], spawn_location[1], object_type)
 
     def update_fov(self):
         '''
         Update the player's field of view
+        Only the cells within FOV_RADIUS of the player are computed, and only
+        the cells whose visibility changed are written, kept as (xs, ys) in fov_changed
         '''
-        # Create an array of transparency
-        # TODO: Maybe have an array of transparency for the entire map
-        #       stored in memory and updated when map changes?
-        tiles = np.ones((constants.CAMERA_WIDTH_CELL + 1,
-                         constants.CAMERA_HEIGHT_CELL + 1),
-                        dtype=bool)
-        # Get every visible tile
-        for y_index, y_tile in enumerate(range(self.camera.location[1],
-                                               self.camera.location[1] +
-                                               constants.CAMERA_HEIGHT_CELL + 1)):
-            for x_index, x_tile in enumerate(range(self.camera.location[0],
-                                                   self.camera.location[0] +
-                                                   constants.CAMERA_WIDTH_CELL + 1)):
-                # Store it's visibility in 2d array
-                tiles[x_index][y_index] = self.map.tiles[x_tile][y_tile].check_transparency()
-
-        # Pass the array into tcod.map.compute_fov() with player's position
-        res = compute_fov(
-            tiles,
-            (self.player.location[0] - self.camera.location[0],
-             self.player.location[1] - self.camera.location[1]),
-            radius=constants.FOV_RADIUS,
-            algorithm=constants.FOV_ALG)
-
-        # Go through the returned array and update every tile in that location
-        for y_index, y_tile in enumerate(range(self.camera.location[1],
-                                               self.camera.location[1] +
-                                               constants.CAMERA_HEIGHT_CELL + 1)):
-            for x_index, x_tile in enumerate(range(self.camera.location[0],
-                                                   self.camera.location[0] +
-                                                   constants.CAMERA_WIDTH_CELL + 1)):
-                tile_to_update = self.map.tiles[x_tile][y_tile]
-                tile_to_update.visible = res[x_index][y_index]
-                tile_to_update.explored = True if res[x_index][y_index] else tile_to_update.explored
-
-    def increment_turn(self):
-        '''
-        Increment one game turn
-        '''
-        self.game_stats.turn_count += 1
-        new_time = (
-            self.game_stats.time[0],    # Hours
-            self.game_stats.time[1] + constants.MINUTES_PER_TURN    # Minutes
-        )
-
-        # Adjust for time overflow
-        if(new_time[1] > 59):
-            new_time = (new_time[0] + 1, 0)
-        if(new_time[0] > 23):
-            new_time = (0, new_time[1])
-        self.game_stats.time = new_time
-
-        # Update player info
-        self.player_info.update_all_info(self.player, self.game_stats)
+        phase_start = self.profiler.start()
+        box = fov.get_fov_box(self.player.location, self.map.width, self.map.height)
+
+        # Reuse the result from the last time the player stood here, if
+        # nothing around has changed since
+        res = self.map.fov_cache.get(self.player.location)
+
+        if(res is None):
+            tiles = self.map.transparency[box[0]:box[2], box[1]:box[3]]
+
+            # Pass the array into tcod.map.compute_fov() with player's position
+            res = compute_fov(
+                tiles,
+                (self.player.location[0] - box[0],
+                 self.player.location[1] - box[1]),
+                radius=constants.FOV_RADIUS,
+                algorithm=constants.FOV_ALG)
+            self.map.fov_cache.put(self.player.location, res)
+
+        # Cells of the last box that aren't in this one go out of view
+        area = fov.join_boxes(box, self.fov_box) if self.fov_box else box
+        new_visible = np.zeros((area[2] - area[0], area[3] - area[1]), dtype=bool)
+        new_visible[box[0] - area[0]:box[2] - area[0], box[1] - area[1]:box[3] - area[1]] = res
+
+        # Only write back the visibility that changed
+        xs, ys = np.nonzero(self.map.visible[area[0]:area[2], area[1]:area[3]] != new_visible)
+        self.fov_changed = (xs + area[0], ys + area[1])
+        if(len(xs) and isinstance(self.map.visible, np.ndarray)):
+            self.map.visible[self.fov_changed] = new_visible[xs, ys]
+
+            # Cells coming into view are the only ones that can be seen for the first time
+            seen = new_visible[xs, ys]
+            self.map.explored[xs[seen] + area[0], ys[seen] + area[1]] = True
+        elif(len(xs)):
+            # Chunked layers are written an area at a time
+            self.map.visible[area[0]:area[2], area[1]:area[3]] = new_visible
+
+            # Only write explored if some cells were seen for the first time
+            explored = self.map.explored[box[0]:box[2], box[1]:box[3]]
+            if((res & ~explored).any()):
+                self.map.explored[box[0]:box[2], box[1]:box[3]] = explored | res
+
+        self.fov_box = box
+        self.profiler.stop("update_fov", phase_start)
+
+    def increment_turn(self, turns=1):
+        '''
+        Run game turns, refreshing the player's view and info once at the end
+        '''
+        self.scheduler.schedule(turns)
+        self.run_turns()
+
+    def run_turns(self):
+        '''
+        Run every turn queued on the scheduler, then update the FOV and the
+        player info once for the whole batch
+        '''
+        if(self.scheduler.run()):
+            self.update_fov()
+            self.player_info.update_all_info(self.player, self.game_stats)
 
     def draw(self):
         '''
         Draw all the things in the game
+        Returns the list of screen rectangles that changed
         '''
+        dirty_rects = []
+        phase_start = self.profiler.start()
 
-        # Clear both surfaces with black
-        self.surface_main.fill(pygame.Color(0, 0, 0))
+        # Clear the whole screen only when everything is redrawn
+        if(self.redraw_all):
+            self.surface_main.fill(pygame.Color(0, 0, 0))
         self.surface_map.fill(pygame.Color(0, 0, 0))
-        self.surface_hud.fill(pygame.Color(0, 0, 0, 0))
 
         # Draw the map onto the surface map
         self.map.draw(self.surface_map, self.camera)
+        phase_start = self.profiler.stop("map_draw", phase_start)
 
-        # Draw the player info
-        # TODO: Create container for all the HUDs?
-        self.player_info.draw(self.surface_hud)
-        self.nearby_actions.draw(self.surface_hud, GameEngine.state)
-        self.inspection_panel.draw(self.surface_hud)
+        # Draw the objects occupying cells
+        self.map.draw_objects(self.surface_map, self.camera)
 
-        # Check if every object is visible, and draw the visible ones
-        for game_object in self.objects:
-            if(self.map.tiles[game_object.location[0]][game_object.location[1]].visible):
+        # Check if every other object in view is visible, and draw the visible ones
+        x_start, y_start = self.camera.location
+        for game_object in self.objects.query(x_start, y_start,
+                                              x_start + constants.CAMERA_WIDTH_CELL + 2,
+                                              y_start + constants.CAMERA_HEIGHT_CELL + 2):
+            if(self.map.visible[game_object.location]):
                 game_object.draw(self.surface_map, self.camera)
 
         # Check if we are in inspect mode, and show the cursor if so
         if(GameEngine.state == "INSPECT" or GameEngine.state == "ACTIONS"):
-            cell_location = (self.i_cursor.location[0] * constants.CELL_WIDTH,
-                             self.i_cursor.location[1] * constants.CELL_HEIGHT)
+            cell_location = self.camera.get_surface_position(self.i_cursor.location)
 
-            self.surface_map.blit(SpriteLoader.sprites.get("cursor").image[0],
-                                  (cell_location[0], cell_location[1]))
+            self.surface_map.blit(*SpriteLoader.sprites.get("cursor").get_blit(cell_location))
+        phase_start = self.profiler.stop("objects_draw", phase_start)
 
-        # Blit the surface map to the main surface
+        # Blit the surface map to the main surface, part of drawing the map
         self.surface_main.blit(self.surface_map,
-                               ((constants.DISPLAY_WIDTH // 5),
-                                0),
-                               self.camera.get_rect())
+                               self.map_rect.topleft,
+                               pygame.Rect((0, 0), self.map_rect.size))
+        dirty_rects.append(self.map_rect)
+        phase_start = self.profiler.stop("map_draw", phase_start)
+
+        # Draw the huds that changed
+        # TODO: Create container for all the HUDs?
+        dirty_rects.append(self.player_info.draw(self.surface_main, self.redraw_all))
+        dirty_rects.append(self.nearby_actions.draw(self.surface_main, GameEngine.state,
+                                                    self.redraw_all))
+        dirty_rects.append(self.inspection_panel.draw(self.surface_main, self.redraw_all))
+        if(self.profiler_panel):
+            dirty_rects.append(self.profiler_panel.draw(self.surface_main, self.redraw_all))
+        self.profiler.stop("huds", phase_start)
+
+        if(self.redraw_all):
+            self.redraw_all = False
+            return [self.surface_main.get_rect()]
 
-        # Blit the surface hud to the main surface
-        self.surface_main.blit(self.surface_hud, (0, 0))
+        return [rect for rect in dirty_rects if rect]
 
     def handle_input(self, inputs):
         '''
         Handle all the inputs
+        Returns True if anything that is drawn may have changed
         '''
+        changed = False
+
         # Check inputs
         if(inputs.get("quit")):
             # Quit the game
             self.quit_game = True
+            changed = True
+
+        if(inputs.get("redraw")):
+            # The window needs repainting, so redraw the whole screen
+            self.redraw_all = True
+            changed = True
 
         if(inputs.get("move_player")):
+            changed = True
+
             # Get the direction
             direction = inputs.get("move_player")
 
             # Player move command
             if(GameEngine.state == "GAMEPLAY"):
                 # Move the player
+                old_location = self.player.location
                 self.player.move(direction)
+                self.objects.move(self.player, old_location)
                 # Move inspection cursor with player
                 self.i_cursor.move(direction)
                 # Set the camera on the player
                 self.camera.center_at(self.player.location)
+                # Make sure the world around the player is ready
+                self.map.stream(self.player.location)
                 # Get new nearby actions
-                self.nearby_actions.set_actions(player.get_nearby_actions(self.player,
-                                                                          self.map.tiles))
-                # Update FOV
-                self.update_fov()
-                # Increment turn
-                self.increment_turn()
+                self.nearby_actions.set_actions(player.get_nearby_actions(self.player, self.map))
+                # Moving takes a turn
+                self.scheduler.schedule()
             elif(GameEngine.state == "ACTIONS"):
                 # Change active action
                 self.nearby_actions.move_active_action(direction)
@@ -256,6 +448,7 @@ class GameEngine:
                 self.i_cursor.move(direction)
 
         if(inputs.get("toggle_actions")):
+            changed = True
             # Toggle the action select mode
             if(GameEngine.state != "ACTIONS"):
                 GameEngine.state = "ACTIONS"
@@ -270,6 +463,7 @@ class GameEngine:
                 self.i_cursor.set_location(self.player.location)
 
         if(inputs.get("toggle_inspect")):
+            changed = True
             # Toggle the inspect mode
             if(GameEngine.state != "INSPECT"):
                 # Set inspection mode if not in it
@@ -280,22 +474,32 @@ class GameEngine:
                 # Reset the cursor to players location
                 self.i_cursor.set_location(self.player.location)
 
+        if(inputs.get("rest") and GameEngine.state == "GAMEPLAY"):
+            changed = True
+            # Rest in place for a number of turns
+            self.scheduler.schedule(inputs.get("rest"))
+
+        if(inputs.get("save")):
+            self.save_game()
+
+        if(inputs.get("load") and os.path.exists(constants.SAVE_PATH)):
+            changed = True
+            self.load_game()
+
         if(inputs.get("return")):
             if(GameEngine.state == "ACTIONS"):
                 if(self.nearby_actions.has_actions()):
+                    changed = True
                     # Get the action
                     active_action = self.nearby_actions.get_active_action()
 
-                    # Commit the action
+                    # Commit the action, which takes a turn
                     self.handle_action_response(active_action.act())
-
-                    # Update FOV
-                    self.update_fov()
-                    self.increment_turn()
+                    self.scheduler.schedule()
 
                     # Get new nearby actions
                     self.nearby_actions.set_actions(
-                        player.get_nearby_actions(self.player, self.map.tiles))
+                        player.get_nearby_actions(self.player, self.map))
 
                     # If we have new actions, be sure to move the inspection cursor to it
                     if(self.nearby_actions.has_actions()):
@@ -309,6 +513,9 @@ class GameEngine:
                         self.i_cursor.set_location(
                             self.player.location)
 
+        # Run the turns the inputs took, all at once
+        self.run_turns()
+
         # We do this stuff after EVERY input
         # Update player location in the hud
         self.player_info.update_location(self.player.location)
@@ -318,19 +525,49 @@ class GameEngine:
             self.i_cursor.location[0]][
             self.i_cursor.location[1]]
 
-    def start(self):
+        return changed
+
+    def start(self, event_driven=False, record_path=None, recording=None, profile=False,
+              profile_path=None):
         '''
         Begins the game loop
+        event_driven: bool, see main_loop
+        record_path: str, file to save a recording of the inputs to when the game ends
+        recording: Recording, inputs to replay instead of reading them, see main_loop
+        profile: bool, time the phases of every frame and show them in an overlay
+        profile_path: str, file to write every frame's timings to when profiling
+        '''
+        self.setup()
+
+        # Time every frame from the first one
+        if(profile):
+            self.enable_profiler(profile_path)
+
+        # Record every frame's inputs with the seed the world came from
+        if(record_path):
+            self.recorder = InputRecorder(self.map.seed, self.chunked_world,
+                                          (self.map.width, self.map.height),
+                                          self.mapped_world)
+            self.record_path = record_path
+
+        # Start the main loop of the game
+        self.main_loop(event_driven, recording)
+
+    def setup(self, forest_density=world.FOREST_DENSITY_VECTORIZED):
+        '''
+        Create the player and the world, ready for the first frame
+        forest_density: float, see Map.generate_forests
         '''
 
         # Create a player
         self.player = player.Player(constants.CAMERA_WIDTH_CELL // 2,
                                     constants.CAMERA_HEIGHT_CELL // 2)
-        # Add player to objects list
-        self.objects.append(self.player)
+        # Add player to the objects index
+        self.objects.insert(self.player)
 
         # TEmp map generation
-        self.map.generate_forests(self.objects)
+        self.map.generate_forests(density=forest_density, workers=self.workers)
+        self.map.stream(self.player.location)
 
         # First time update of player HUD and inspection cursor location
         self.player_info.update_all_info(self.player, self.game_stats)
@@ -339,46 +576,230 @@ class GameEngine:
         # First time fov compute
         self.update_fov()
 
-        # Start the main loop of the game
-        self.main_loop()
+    def save_game(self, path=constants.SAVE_PATH):
+        '''
+        Save the game to a file
+        '''
+        try:
+            saves.save_game(path, self.map, self.player, self.game_stats)
+        except ValueError as error:
+            # Worlds that can't be saved leave the game running
+            print(error)
 
-    def main_loop(self):
+    def load_game(self, path=constants.SAVE_PATH):
+        '''
+        Replace the game with one saved to a file
+        '''
+        self.map, self.player = saves.load_game(path, self.game_stats)
+        self.chunked_world = False
+        self.mapped_world = False
+
+        # Add player to the new objects index
+        self.objects = self.map.objects
+        self.objects.insert(self.player)
+
+        # Nothing of the new map has been seen yet
+        self.fov_box = None
+
+        # Look at the player on the new map
+        GameEngine.state = "GAMEPLAY"
+        self.camera = world.Camera(0, 0, self.map.width, self.map.height)
+        self.camera.center_at(self.player.location)
+        self.i_cursor.set_location(self.player.location)
+
+        # Refresh everything shown
+        self.player_info.update_all_info(self.player, self.game_stats)
+        self.nearby_actions.set_actions(player.get_nearby_actions(self.player, self.map))
+        self.update_fov()
+        self.redraw_all = True
+
+    def main_loop(self, event_driven=False, recording=None):
         '''
         The main game loop while running
+        event_driven: bool, block until there is input and only draw when
+                      something changed, instead of drawing at a fixed framerate
+        recording: Recording, feed its inputs in as fast as possible instead
+                   of reading them, the engine must use the recording's world
         '''
 
         # When this is True we will quit
         self.quit_game = False
 
+        loop_stats = LoopStats()
+
+        if(recording):
+            self.run_replay(loop_stats, recording)
+        elif(event_driven):
+            self.run_event_driven(loop_stats)
+        else:
+            self.run_fixed_rate(loop_stats)
+
+        print(loop_stats.report())
+
+        # Write the last of the frame timings
+        self.profiler.flush()
+
+        # Save the recording of this game
+        if(self.recorder):
+            self.recorder.save(self.record_path)
+            print("Recorded " + str(self.recorder.frame_count) + " frames to " +
+                  self.record_path)
+
+        # Exit the application
+        pygame.quit()
+        sys.exit()
+
+    def update_display(self):
+        '''
+        Draw everything and update the parts of the display that changed
+        '''
+        dirty_rects = self.draw()
+        phase_start = self.profiler.start()
+        pygame.display.update(dirty_rects)
+        self.profiler.stop("display_update", phase_start)
+
+    def enable_profiler(self, csv_path=None):
+        '''
+        Start timing the phases of every frame, showing them in an overlay
+        csv_path: str, file every frame's timings are written to, None to keep none
+        '''
+        self.profiler = FrameProfiler(True, csv_path)
+        if(not self.headless):
+            self.profiler_panel = hud.hud_ProfilerPanel(
+                constants.DISPLAY_WIDTH // 5,
+                (constants.DISPLAY_HEIGHT * 2) // 3,
+                (0, constants.DISPLAY_HEIGHT // 3))
+
+    def end_profiled_frame(self):
+        '''
+        Finish timing a drawn frame, refreshing the overlay every PROFILE_OVERLAY_FRAMES frames
+        Returns True if the overlay changed and needs drawing
+        '''
+        self.profiler.end_frame()
+        if(self.profiler_panel and
+           self.profiler.frame_count % constants.PROFILE_OVERLAY_FRAMES == 0):
+            self.profiler_panel.update_percentiles(self.profiler.get_percentiles())
+            return self.profiler_panel.dirty
+        return False
+
+    def run_fixed_rate(self, loop_stats):
+        '''
+        Handle input and draw every frame at a fixed framerate until we quit
+        '''
+
         # While we don't want to quit the game
         while not self.quit_game:
             # Get inputs
+            phase_start = self.profiler.start()
             inputs = get_inputs()
+            if(self.recorder):
+                self.recorder.record(inputs)
+            phase_start = self.profiler.stop("input", phase_start)
 
             # Handle inputs
             self.handle_input(inputs)
+            self.profiler.stop("handle_input", phase_start)
 
-            # Draw everything
-            self.draw()
-
-            # Update the display
-            pygame.display.update()
+            # Draw everything and update the parts of the display that changed
+            self.update_display()
+            loop_stats.frames_drawn += 1
+            self.end_profiled_frame()
 
             # Limit Framerate to 15 fps
-            self.clock.tick(15)
+            self.clock.tick(constants.FRAMES_PER_SECOND)
 
-        # Exit the application
-        pygame.quit()
-        sys.exit()
+    def run_event_driven(self, loop_stats):
+        '''
+        Wait for input and only draw when something changed until we quit
+        '''
+
+        # Wake up at least this often even without input
+        pygame.time.set_timer(TICK_EVENT, constants.EVENT_WAIT_TIMEOUT)
+
+        # Always draw the first frame
+        needs_draw = True
+
+        # While we don't want to quit the game
+        while not self.quit_game:
+            if(needs_draw):
+                # Draw everything and update the parts of the display that changed
+                self.update_display()
+                loop_stats.frames_drawn += 1
+
+                # Only drawn frames are timed, and a refreshed overlay is drawn next time
+                needs_draw = self.end_profiled_frame()
 
+            # Wait for an event or the timer
+            loop_stats.start_idle()
+            events = [pygame.event.wait()]
+            loop_stats.end_idle()
 
-def get_inputs():
+            # Get inputs
+            phase_start = self.profiler.start()
+            inputs = get_inputs(events + pygame.event.get())
+            if(self.recorder):
+                self.recorder.record(inputs)
+            phase_start = self.profiler.stop("input", phase_start)
+
+            # Handle inputs, and skip the next frame if nothing changed
+            if(self.handle_input(inputs) or self.redraw_all):
+                needs_draw = True
+            else:
+                loop_stats.frames_skipped += 1
+            self.profiler.stop("handle_input", phase_start)
+
+        pygame.time.set_timer(TICK_EVENT, 0)
+
+    def run_replay(self, loop_stats, recording):
+        '''
+        Handle every recorded frame's inputs without waiting between frames,
+        drawing only the frames where something changed
+        '''
+        start = time.perf_counter()
+        frames = 0
+
+        # Always draw the first frame
+        needs_draw = True
+
+        for inputs in recording.get_frames():
+            if(needs_draw):
+                # Draw everything and update the parts of the display that changed
+                self.update_display()
+                loop_stats.frames_drawn += 1
+
+                # Only drawn frames are timed, and a refreshed overlay is drawn next time
+                needs_draw = self.end_profiled_frame()
+
+            if(self.quit_game):
+                break
+
+            # Keep the window responding
+            phase_start = self.profiler.start()
+            pygame.event.pump()
+            phase_start = self.profiler.stop("input", phase_start)
+
+            # Handle inputs, and skip the next frame if nothing changed
+            if(self.handle_input(inputs) or self.redraw_all):
+                needs_draw = True
+            else:
+                loop_stats.frames_skipped += 1
+            self.profiler.stop("handle_input", phase_start)
+            frames += 1
+
+        seconds = time.perf_counter() - start
+        print("Replayed " + str(frames) + " frames, " +
+              str(self.game_stats.turn_count) + " turns in " + format(seconds, ".2f") + "s")
+
+
+def get_inputs(events_list=None):
     '''
     Handle input events
+    events_list: list of pygame events, defaults to every queued event
     '''
 
     # Get the list of inputs
-    events_list = pygame.event.get()
+    if(events_list is None):
+        events_list = pygame.event.get()
     # Return dictionary
     res = {}
 
@@ -388,6 +809,10 @@ def get_inputs():
         if(event.type == pygame.QUIT):
             res["quit"] = True
 
+        # If the window needs repainting
+        if(event.type == pygame.VIDEOEXPOSE):
+            res["redraw"] = True
+
         # If a key was pressed
         if(event.type == pygame.KEYDOWN):
             if(event.key == pygame.K_ESCAPE):
@@ -406,10 +831,58 @@ def get_inputs():
                 res["return"] = True
             if(event.key == pygame.K_i):
                 res["toggle_inspect"] = True
+            if(event.key == pygame.K_PERIOD):
+                res["rest"] = 1
+            if(event.key == pygame.K_r):
+                res["rest"] = constants.REST_TURNS
+            if(event.key == pygame.K_F5):
+                res["save"] = True
+            if(event.key == pygame.K_F9):
+                res["load"] = True
 
     return res
 
 
 if __name__ == '__main__':
-    ge = GameEngine()
-    ge.start()
+    parser = argparse.ArgumentParser(description="Play the game")
+    parser.add_argument("--chunked", action="store_true",
+                        help="play on a chunked world streamed from disk")
+    parser.add_argument("--mapped", action="store_true",
+                        help="play on a huge world kept in memory mapped files")
+    parser.add_argument("--event-driven", action="store_true",
+                        help="only draw when something changed")
+    parser.add_argument("--seed", type=int, help="seed of the world, random if not given")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes to generate the world across")
+    parser.add_argument("--record", metavar="PATH",
+                        help="save the inputs of this game to a file when it ends")
+    parser.add_argument("--replay", metavar="PATH",
+                        help="replay the inputs recorded to a file at full speed")
+    parser.add_argument("--load", metavar="PATH", help="continue a saved game")
+    parser.add_argument("--profile", action="store_true",
+                        help="time the phases of every frame and show them in an overlay")
+    parser.add_argument("--profile-csv", metavar="PATH", default=constants.PROFILE_PATH,
+                        help="file to write every frame's timings to when profiling")
+    args = parser.parse_args()
+    profile_path = args.profile_csv if args.profile else None
+
+    if(args.replay):
+        # Recreate the world the recording was made in
+        replay = Recording(args.replay)
+        ge = GameEngine(chunked_world=replay.chunked_world, map_size=replay.map_size,
+                        seed=replay.seed, mapped_world=replay.mapped_world)
+        ge.start(recording=replay, profile=args.profile, profile_path=profile_path)
+    elif(args.load):
+        # Start on a small world, then replace it with the saved one
+        ge = GameEngine(map_size=(constants.CAMERA_WIDTH_CELL + 1,
+                                  constants.CAMERA_HEIGHT_CELL + 1))
+        ge.setup(forest_density=0)
+        ge.load_game(args.load)
+        if(args.profile):
+            ge.enable_profiler(profile_path)
+        ge.main_loop(args.event_driven)
+    else:
+        ge = GameEngine(chunked_world=args.chunked, seed=args.seed, mapped_world=args.mapped,
+                        workers=args.workers)
+        ge.start(event_driven=args.event_driven, record_path=args.record,
+                 profile=args.profile, profile_path=profile_path)
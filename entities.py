@@ -0,0 +1,154 @@
+'''
+The entities module stores the objects occupying map cells as columns of
+typed arrays, one row per entity, so whole types of them can be handled at once
+'''
+import numpy as np
+
+from objects import OBJECT_TYPES
+
+
+# Entity types, indexed by type id
+ENTITY_TYPES = tuple(OBJECT_TYPES.values())
+TYPE_IDS = {object_type: type_id for type_id, object_type in enumerate(ENTITY_TYPES)}
+TYPE_IDS_BY_NAME = {object_type.name: type_id for object_type, type_id in TYPE_IDS.items()}
+
+# Whether each type lets light through, indexed by type id
+TYPE_TRANSPARENCY = np.array([object_type.transparent is not False
+                              for object_type in ENTITY_TYPES], dtype=bool)
+
+# Whether objects of each type have any actions, indexed by type id
+TYPE_HAS_ACTIONS = np.array([bool(object_type.make_actions((0, 0)))
+                             for object_type in ENTITY_TYPES], dtype=bool)
+
+# Type id of the rows of destroyed entities
+NO_TYPE = -1
+
+# Rows the columns start out with, they double whenever they fill up
+ENTITY_CAPACITY = 1024
+
+
+class EntityStore:
+    '''
+    Entities stored as a row across columns of positions, type ids,
+    transparency and state
+    Entity ids are row indexes, and the rows of destroyed entities are kept on
+    a free list to be reused, so creating and destroying one entity is O(1)
+    '''
+
+    def __init__(self, capacity=ENTITY_CAPACITY):
+        # Columns, indexed by entity id
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.types = np.full(capacity, NO_TYPE, dtype=np.int16)
+        self.transparent = np.ones(capacity, dtype=bool)
+        # Free for systems to use for whatever their type needs
+        self.state = np.zeros(capacity, dtype=np.int32)
+
+        # Rows below size have been used, and free_ids are the destroyed ones among them
+        self.size = 0
+        self.free_ids = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def create(self, object_type, x, y):
+        '''
+        Create an entity of an object type at cell (x, y)
+        Returns the entity id
+        '''
+        if(self.free_ids):
+            entity_id = self.free_ids.pop()
+        else:
+            self.reserve(self.size + 1)
+            entity_id = self.size
+            self.size += 1
+
+        type_id = TYPE_IDS[object_type]
+        self.x[entity_id] = x
+        self.y[entity_id] = y
+        self.types[entity_id] = type_id
+        self.transparent[entity_id] = TYPE_TRANSPARENCY[type_id]
+        self.state[entity_id] = 0
+        self.count += 1
+
+        return entity_id
+
+    def create_many(self, object_type, xs, ys):
+        '''
+        Create an entity of an object type at each cell (xs[i], ys[i])
+        Returns an array of the entity ids
+        '''
+        count = len(xs)
+
+        # Reuse free rows first, then append the rest
+        free_start = len(self.free_ids) - min(count, len(self.free_ids))
+        reused = self.free_ids[free_start:]
+        del self.free_ids[free_start:]
+        appended = count - len(reused)
+        self.reserve(self.size + appended)
+        entity_ids = np.concatenate([np.array(reused, dtype=np.int32),
+                                     np.arange(self.size, self.size + appended, dtype=np.int32)])
+        self.size += appended
+
+        type_id = TYPE_IDS[object_type]
+        self.x[entity_ids] = xs
+        self.y[entity_ids] = ys
+        self.types[entity_ids] = type_id
+        self.transparent[entity_ids] = TYPE_TRANSPARENCY[type_id]
+        self.state[entity_ids] = 0
+        self.count += count
+
+        return entity_ids
+
+    def destroy(self, entity_id):
+        '''
+        Destroy an entity, freeing its row to be reused
+        '''
+        self.types[entity_id] = NO_TYPE
+        self.free_ids.append(int(entity_id))
+        self.count -= 1
+
+    def destroy_many(self, entity_ids):
+        '''
+        Destroy every entity in an array of entity ids
+        '''
+        self.types[entity_ids] = NO_TYPE
+        self.free_ids.extend(entity_ids.tolist())
+        self.count -= len(entity_ids)
+
+    def reserve(self, capacity):
+        '''
+        Grow the columns to hold at least capacity rows
+        '''
+        old_capacity = len(self.types)
+        if(capacity <= old_capacity):
+            return
+
+        new_capacity = max(capacity, old_capacity * 2)
+        for name, fill in (("x", 0), ("y", 0), ("types", NO_TYPE),
+                           ("transparent", True), ("state", 0)):
+            column = getattr(self, name)
+            grown = np.full(new_capacity, fill, dtype=column.dtype)
+            grown[:old_capacity] = column
+            setattr(self, name, grown)
+
+    def get_object_type(self, entity_id):
+        '''
+        Get the object type of an entity
+        '''
+        return ENTITY_TYPES[self.types[entity_id]]
+
+    def get_view(self, entity_id):
+        '''
+        Make a game object of an entity's type at its cell
+        The entity's state lives in the store, so the object is only a view of it
+        '''
+        return ENTITY_TYPES[self.types[entity_id]](int(self.x[entity_id]),
+                                                   int(self.y[entity_id]))
+
+    def get_ids_of_type(self, object_type):
+        '''
+        Get an array of the ids of every entity of an object type
+        '''
+        return np.flatnonzero(self.types[:self.size] == TYPE_IDS[object_type])
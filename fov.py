@@ -0,0 +1,73 @@
+'''
+The fov module bounds the player's field of view to the cells within
+FOV_RADIUS, and keeps what the player could see from cells they stood on,
+so standing on one of them again costs a lookup instead of a recompute
+'''
+from collections import OrderedDict
+import constants
+
+
+def get_fov_box(location, width, height):
+    '''
+    Get (x_start, y_start, x_end, y_end) of the cells within FOV_RADIUS of
+    location, clamped to a map of the given size
+    '''
+    return (max(location[0] - constants.FOV_RADIUS, 0),
+            max(location[1] - constants.FOV_RADIUS, 0),
+            min(location[0] + constants.FOV_RADIUS + 1, width),
+            min(location[1] + constants.FOV_RADIUS + 1, height))
+
+
+def join_boxes(box, other):
+    '''
+    Get the smallest box holding both boxes
+    '''
+    return (min(box[0], other[0]), min(box[1], other[1]),
+            max(box[2], other[2]), max(box[3], other[3]))
+
+
+class FovCache:
+    '''
+    Field of view results over the FOV box of a player cell, keyed by the
+    cell, least recently used evicted past the cache size
+    Entries are dropped when the transparency of a cell within FOV_RADIUS of
+    their player cell changes, as only those cells can change what is seen
+    '''
+
+    def __init__(self, cache_size=constants.FOV_CACHE_SIZE):
+        self.cache_size = cache_size
+        # Visible arrays by player cell, least recently used first
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        '''
+        Get the visible array stored for a key, or None
+        '''
+        res = self.entries.get(key)
+        if(res is not None):
+            self.entries.move_to_end(key)
+        return res
+
+    def put(self, key, res):
+        '''
+        Store the visible array for a key, it must not be changed afterwards
+        '''
+        self.entries[key] = res
+        self.entries.move_to_end(key)
+        if(len(self.entries) > self.cache_size):
+            self.entries.popitem(last=False)
+
+    def update(self, location):
+        '''
+        Drop every entry the transparency of the cell at location can change
+        '''
+        for key in [key for key in self.entries
+                    if(max(abs(key[0] - location[0]),
+                           abs(key[1] - location[1])) <= constants.FOV_RADIUS)]:
+            del self.entries[key]
+
+    def clear(self):
+        '''
+        Drop every entry
+        '''
+        self.entries.clear()
@@ -2,10 +2,24 @@
 This module contains various classes and functions for graphics manipulation
 '''
 
+import math
 import pygame
 from constants import CELL_WIDTH, CELL_HEIGHT
 
 
+# How bright explored tiles out of view are drawn, out of 255
+FOG_BRIGHTNESS = 50
+
+# Every sprite SpriteLoader loads, by name
+SPRITE_FILES = {
+    "snow": "resources/sprites/snow.png",
+    "rock": "resources/sprites/rock.png",
+    "tree": "resources/sprites/tree.png",
+    "wood": "resources/sprites/wood.png",
+    "cursor": "resources/sprites/cursor.png"
+}
+
+
 class Sprite:
     '''
     A pygame surface containing a scaled image to represent objects
@@ -18,26 +32,100 @@ class Sprite:
             self.image = [pygame.transform.scale(
                 pygame.image.load(file_path), (CELL_WIDTH, CELL_HEIGHT)
             )]
+            # Darkened copies for explored tiles out of view
+            self.fog_image = [darken(image) for image in self.image]
         else:
             # Load in multiple images from sprite sheet
             return
 
+        # Where the frames are in a SpriteAtlas, once one packs this sprite
+        self.atlas = None
+        self.areas = []
+        self.fog_areas = []
+
+    def get_blit(self, position, fogged=False, frame=0):
+        '''
+        Get a (source, position, area) tuple for Surface.blits() that draws a
+        frame of this sprite at position
+        '''
+        if(self.atlas):
+            return (self.atlas,
+                    position,
+                    self.fog_areas[frame] if fogged else self.areas[frame])
+
+        return (self.fog_image[frame] if fogged else self.image[frame], position)
+
+
+class SpriteAtlas:
+    '''
+    Packs every frame of a set of sprites into one surface in the display's
+    pixel format, so they blit without conversion and can be drawn in batches
+    '''
+
+    def __init__(self, sprites):
+        # Every frame to pack, normal and darkened
+        frames = []
+        for sprite in sprites:
+            if(not sprite.animates):
+                frames.extend(sprite.image)
+                frames.extend(sprite.fog_image)
+
+        # Lay the frames out in a square grid of cells
+        columns = max(math.ceil(math.sqrt(len(frames))), 1)
+        rows = max(math.ceil(len(frames) / columns), 1)
+        self.surface = pygame.Surface((columns * CELL_WIDTH, rows * CELL_HEIGHT),
+                                      pygame.SRCALPHA)
+
+        areas = []
+        for index, frame in enumerate(frames):
+            area = pygame.Rect((index % columns) * CELL_WIDTH,
+                               (index // columns) * CELL_HEIGHT,
+                               CELL_WIDTH,
+                               CELL_HEIGHT)
+            self.surface.blit(frame, area)
+            areas.append(area)
+
+        # Match the display's pixel format, if there is a display yet
+        if(pygame.display.get_surface()):
+            self.surface = self.surface.convert_alpha()
+
+        # Point every sprite at its frames in the atlas
+        areas = iter(areas)
+        for sprite in sprites:
+            if(sprite.animates):
+                continue
+            sprite.atlas = self.surface
+            sprite.areas = [next(areas) for _ in sprite.image]
+            sprite.fog_areas = [next(areas) for _ in sprite.fog_image]
+            sprite.image = [self.surface.subsurface(area) for area in sprite.areas]
+            sprite.fog_image = [self.surface.subsurface(area) for area in sprite.fog_areas]
+
 
 class SpriteLoader:
     '''
     Sprite Loader handles keeping all our image references in one place
     '''
     sprites = {}
+    atlas = None
 
     @staticmethod
     def load_sprites():
         '''
         This static method can be called with .get() to get any image references
+        Call it after the display is set so the atlas matches its pixel format
         '''
-        SpriteLoader.sprites = {
-            "snow": Sprite("resources/sprites/snow.png"),
-            "rock": Sprite("resources/sprites/rock.png"),
-            "tree": Sprite("resources/sprites/tree.png"),
-            "wood": Sprite("resources/sprites/wood.png"),
-            "cursor": Sprite("resources/sprites/cursor.png")
-        }
+        SpriteLoader.sprites = {name: Sprite(file_path)
+                                for name, file_path in SPRITE_FILES.items()}
+
+        # Pack them all into one surface
+        SpriteLoader.atlas = SpriteAtlas(list(SpriteLoader.sprites.values()))
+
+
+def darken(image, brightness=FOG_BRIGHTNESS):
+    '''
+    Return a copy of an image with its colors scaled down to brightness / 255
+    '''
+    res = image.copy()
+    res.fill((brightness, brightness, brightness),
+             special_flags=pygame.BLEND_RGB_MULT)
+    return res
@@ -1,9 +1,10 @@
 '''
 The hud module contains the various HUD info screens and surfaces
 '''
+from collections import OrderedDict
 import pygame
+from profiler import PHASE_LABELS
 from util import format_time, clamp
-from constants import DISPLAY_WIDTH, DISPLAY_HEIGHT
 
 
 WHITE = (255, 255, 255)
@@ -14,19 +15,79 @@ GRAY = (150, 150, 150)
 BORDER_WIDTH = 1
 LINE_SPACING = 4
 
+# Most rendered text surfaces kept by TEXT_CACHE
+TEXT_CACHE_SIZE = 256
+
+
+class TextCache:
+    '''
+    A size bounded cache of rendered text surfaces, dropping the least recently
+    used first
+    Surfaces are shared between callers, so they must not be drawn on
+    '''
+
+    def __init__(self, max_size=TEXT_CACHE_SIZE):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, antialias, color):
+        '''
+        Get text rendered with a font, rendering it only if it isn't cached
+        '''
+        key = (font, text, antialias, tuple(color))
+        surface = self.surfaces.get(key)
+
+        if(surface is not None):
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        self.surfaces[key] = surface
+
+        # Drop the least recently used past the max size
+        if(len(self.surfaces) > self.max_size):
+            self.surfaces.popitem(last=False)
+
+        return surface
+
+
+# The text cache shared by every HUD
+TEXT_CACHE = TextCache()
+
 
 class _hud:
     '''
     The inheireted HUD class which creates a surface for itself
+    The surface is only recomposed when the HUD is marked dirty
+    A headless HUD keeps its state but has no surface or font, and never draws
     '''
 
-    def __init__(self, width, height):
-        self.surface = pygame.surface.Surface((width, height))
+    def __init__(self, width, height, position, headless=False):
         self.surface_width = width
         self.surface_height = height
+        self.position = position
         self.font_size = 32
-        self.font = pygame.font.Font(
-            "resources/Deltoid-sans.ttf", self.font_size, bold=False, italic=False)
+        self.headless = headless
+        self.surface = None
+        self.font = None
+        if(not headless):
+            self.surface = pygame.surface.Surface((width, height))
+            self.font = pygame.font.Font("resources/Deltoid-sans.ttf", self.font_size)
+
+        # If the surface needs to be recomposed
+        self.dirty = True
+        # The text of each line, to tell when it changes
+        self.lines = {}
+
+    def get_rect(self):
+        '''
+        Return the screen rectangle this HUD is drawn in
+        '''
+        return pygame.Rect(self.position, (self.surface_width, self.surface_height))
 
     def draw_border(self, color=None):
         '''
@@ -44,6 +105,46 @@ class _hud:
                                      self.surface_height - (BORDER_WIDTH * 4)),
                          BORDER_WIDTH)
 
+    def render_text(self, text, antialias, color):
+        '''
+        Render text with this HUD's font through the shared text cache, None if headless
+        '''
+        if(self.headless):
+            return None
+        return TEXT_CACHE.render(self.font, text, antialias, color)
+
+    def update_line(self, key, text, antialias=False, color=WHITE):
+        '''
+        Set the text of a line, marking this HUD dirty if it changed
+        Returns the rendered line
+        '''
+        line = (text, antialias, color)
+        if(self.lines.get(key) != line):
+            self.lines[key] = line
+            self.dirty = True
+
+        return self.render_text(text, antialias, color)
+
+    def compose(self):
+        '''
+        Redraw this HUD's own surface, implemented by each HUD
+        '''
+        raise NotImplementedError
+
+    def draw(self, surface, force=False):
+        '''
+        Recompose this HUD if it changed and blit it to the surface
+        Returns the rectangle drawn to, or None if nothing changed
+        '''
+        if(self.headless or (not self.dirty and not force)):
+            return None
+
+        self.compose()
+        self.dirty = False
+
+        surface.blit(self.surface, self.position)
+        return self.get_rect()
+
 
 class hud_InspectionPanel(_hud):
     '''
@@ -72,8 +173,8 @@ class hud_InspectionPanel(_hud):
             self.location = (
                 self.location[0] + direction[0], self.location[1] + direction[1])
 
-    def __init__(self, width, height):
-        super(hud_InspectionPanel, self).__init__(width, height)
+    def __init__(self, width, height, position, headless=False):
+        super(hud_InspectionPanel, self).__init__(width, height, position, headless)
 
         # The currently inspected tile
         self.inpsected_tile = None
@@ -81,7 +182,40 @@ class hud_InspectionPanel(_hud):
         # The cursor of the inspection mode
         self.cursor = self.Cursor()
 
-    def draw(self, surface_hud):
+        # The rendered info lines of the inspected tile
+        self.tile_terrain = None
+        self.tile_object = None
+
+    def update_tile_info(self):
+        '''
+        Update the info lines from the inspected tile, which may have changed
+        since it was set
+        '''
+        self.tile_terrain = None
+        self.tile_object = None
+        terrain_text = None
+        object_text = None
+
+        # Get the current tile info if we know of the tile
+        if(self.inpsected_tile and self.inpsected_tile.explored):
+            terrain_text = "Terrain: " + self.inpsected_tile.terrain
+
+            # Check if there is an object on this tile and we can see it
+            obj = self.inpsected_tile.contains_obj
+            if(obj and self.inpsected_tile.visible):
+                object_text = "Object: " + obj.name
+
+        if(terrain_text):
+            self.tile_terrain = self.update_line("terrain", terrain_text, True)
+        elif(self.lines.pop("terrain", None)):
+            self.dirty = True
+
+        if(object_text):
+            self.tile_object = self.update_line("object", object_text, True)
+        elif(self.lines.pop("object", None)):
+            self.dirty = True
+
+    def compose(self):
         '''
         Draw the inspection panel
         '''
@@ -92,28 +226,22 @@ class hud_InspectionPanel(_hud):
         # Draw a border
         self.draw_border()
 
-        # Draw the current tile info if we know of the tile
-        if(self.inpsected_tile and self.inpsected_tile.explored):
-            # Render terrain string
-            tile_terrain = self.font.render(
-                "Terrain: " + self.inpsected_tile.terrain, True, WHITE)
-            # Blit terrain string
-            self.surface.blit(tile_terrain, (BORDER_WIDTH + 10, BORDER_WIDTH))
+        # Blit terrain string
+        if(self.tile_terrain):
+            self.surface.blit(self.tile_terrain, (BORDER_WIDTH + 10, BORDER_WIDTH))
 
-            # Check if there is an object on this tile and we can see it
-            if(self.inpsected_tile.contains_obj and self.inpsected_tile.visible):
-                # Render object string
-                tile_object = self.font.render(
-                    "Object: " + self.inpsected_tile.contains_obj.name, True, WHITE)
-                # Blit object string
-                self.surface.blit(
-                    tile_object,
-                    (BORDER_WIDTH + 10, BORDER_WIDTH + self.font.get_linesize() + LINE_SPACING))
+        # Blit object string
+        if(self.tile_object):
+            self.surface.blit(
+                self.tile_object,
+                (BORDER_WIDTH + 10, BORDER_WIDTH + self.font.get_linesize() + LINE_SPACING))
 
-        # Blit onto the main hud surface
-        surface_hud.blit(
-            self.surface,
-            ((DISPLAY_WIDTH * 4) // 5, 0))
+    def draw(self, surface, force=False):
+        '''
+        Draw the inspection panel if the inspected tile's info changed
+        '''
+        self.update_tile_info()
+        return super(hud_InspectionPanel, self).draw(surface, force)
 
 
 class hud_NearbyActionsPanel(_hud):
@@ -121,12 +249,13 @@ class hud_NearbyActionsPanel(_hud):
     The Nearby Actions menu which shows available movements on the right of the screen
     '''
 
-    def __init__(self, width, height):
-        super(hud_NearbyActionsPanel, self).__init__(width, height)
+    def __init__(self, width, height, position, headless=False):
+        super(hud_NearbyActionsPanel, self).__init__(width, height, position, headless)
 
         self.action_list = []
         self.active_action_index = -1
-        self.header = self.font.render("Nearby Actions", False, WHITE)
+        self.gamestate = None
+        self.header = self.render_text("Nearby Actions", False, WHITE)
 
     def get_active_action(self):
         '''
@@ -138,12 +267,17 @@ class hud_NearbyActionsPanel(_hud):
         '''
         Move the active selected action by the specified tuple distance
         '''
+        old_index = self.active_action_index
+
         if(self.has_actions()):
             self.active_action_index = (self.active_action_index +
                                         direction[1]) % len(self.action_list)
         else:
             self.active_action_index = -1
 
+        if(self.active_action_index != old_index):
+            self.dirty = True
+
     def has_actions(self):
         '''
         If there are actions in the list
@@ -154,6 +288,8 @@ class hud_NearbyActionsPanel(_hud):
         '''
         Set the action lists
         '''
+        old_actions = self.action_list
+        old_index = self.active_action_index
 
         # Check if the list of actions is empty or not
         if(len(actions) > 0):
@@ -168,7 +304,10 @@ class hud_NearbyActionsPanel(_hud):
             self.action_list = []
             self.active_action_index = 0
 
-    def draw(self, surface_hud, gamestate):
+        if(self.action_list != old_actions or self.active_action_index != old_index):
+            self.dirty = True
+
+    def compose(self):
         '''
         Draw the action list HUD
         '''
@@ -177,7 +316,7 @@ class hud_NearbyActionsPanel(_hud):
         self.surface.fill(BLACK)
 
         # Draw a border
-        if(gamestate == "ACTIONS"):
+        if(self.gamestate == "ACTIONS"):
             self.draw_border(color=RED)
         else:
             self.draw_border()
@@ -192,11 +331,10 @@ class hud_NearbyActionsPanel(_hud):
         for key, action in enumerate(self.action_list):
             color = GRAY
             # Check if the current active action if the action we are rendering
-            if(self.active_action_index == key and gamestate == "ACTIONS"):
+            if(self.active_action_index == key and self.gamestate == "ACTIONS"):
                 color = RED
 
-            # TODO: Cache this render
-            rendered_string = self.font.render(str(key) + ' ' + action.text,
+            rendered_string = self.render_text(str(key) + ' ' + action.text,
                                                False,
                                                color)
 
@@ -206,9 +344,15 @@ class hud_NearbyActionsPanel(_hud):
 
             self.surface.blit(rendered_string, (x_val, y_val))
 
-        # Blit this hud's surface to the main hud surface
-        surface_hud.blit(self.surface,
-                         ((DISPLAY_WIDTH * 4) // 5, (DISPLAY_HEIGHT // 3)))
+    def draw(self, surface, gamestate, force=False):
+        '''
+        Draw the action list HUD if it or the gamestate changed
+        '''
+        if(gamestate != self.gamestate):
+            self.gamestate = gamestate
+            self.dirty = True
+
+        return super(hud_NearbyActionsPanel, self).draw(surface, force)
 
 
 class hud_PlayerInfoPanel(_hud):
@@ -216,8 +360,8 @@ class hud_PlayerInfoPanel(_hud):
     The player info hud element
     '''
 
-    def __init__(self, width, height):
-        super(hud_PlayerInfoPanel, self).__init__(width, height)
+    def __init__(self, width, height, position, headless=False):
+        super(hud_PlayerInfoPanel, self).__init__(width, height, position, headless)
 
         self.name = None
         self.health = None
@@ -241,59 +385,42 @@ class hud_PlayerInfoPanel(_hud):
         '''
         Update only name
         '''
-        self.name = self.font.render(
-            str(name),
-            False,
-            WHITE)
+        self.name = self.update_line("name", str(name))
 
     def update_health(self, health):
         '''
         Update only health
         '''
-        self.health = self.font.render(
-            str(health),
-            False,
-            WHITE)
+        self.health = self.update_line("health", str(health))
 
     def update_location(self, location):
         '''
         Update only location
         '''
-        self.location = self.font.render(
-            str(location[0]) + ', ' + str(location[1]),
-            False,
-            WHITE)
+        self.location = self.update_line("location",
+                                          str(location[0]) + ', ' + str(location[1]))
 
     def update_time(self, time):
         '''
         Update only time
         '''
-        self.time = self.font.render(
-            format_time(time),
-            False,
-            WHITE)
+        self.time = self.update_line("time", format_time(time))
 
     def update_date(self, date):
         '''
         Update only date
         '''
-        self.date = self.font.render(
-            str(date[0]) + ' ' + str(date[1]),
-            False,
-            WHITE)
+        self.date = self.update_line("date", str(date[0]) + ' ' + str(date[1]))
 
     def update_turn_count(self, turn_count):
         '''
         Update only turn_count
         '''
-        self.turn_count = self.font.render(
-            "Turn " + str(turn_count),
-            False,
-            WHITE)
+        self.turn_count = self.update_line("turn_count", "Turn " + str(turn_count))
 
-    def draw(self, surface_hud):
+    def compose(self):
         '''
-        Draw the hud to the specific surface
+        Draw the hud to its own surface
         '''
 
         # Clear the hud surface
@@ -329,5 +456,57 @@ class hud_PlayerInfoPanel(_hud):
                                             5 * self.font.get_linesize() +
                                             5 * LINE_SPACING +
                                             (BORDER_WIDTH * 4)))
-        # Blit this hud's surface to the main hud surface
-        surface_hud.blit(self.surface, (0, 0))
+
+
+class hud_ProfilerPanel(_hud):
+    '''
+    The profiler overlay, showing the rolling percentiles of each phase of a frame
+    '''
+
+    def __init__(self, width, height, position, headless=False):
+        super(hud_ProfilerPanel, self).__init__(width, height, position, headless)
+
+        self.header = self.render_text("Frame ms p50/p95", False, WHITE)
+        # The rendered line of each phase
+        self.phase_lines = []
+
+    def render_text(self, text, antialias, color):
+        '''
+        Render text straight with this HUD's font, None if headless
+        The timings rarely repeat, so they would only push the other HUDs'
+        text out of the shared text cache
+        '''
+        if(self.headless):
+            return None
+        return self.font.render(text, antialias, color)
+
+    def update_percentiles(self, percentiles):
+        '''
+        Update the lines from FrameProfiler.get_percentiles()
+        '''
+        self.phase_lines = [
+            self.update_line(phase,
+                             PHASE_LABELS[phase] + ' ' +
+                             ' / '.join(format(value, ".2f") for value in values),
+                             False, GRAY)
+            for phase, values in percentiles.items()]
+
+    def compose(self):
+        '''
+        Draw the profiler overlay
+        '''
+
+        # Clear the surface
+        self.surface.fill(BLACK)
+
+        # Draw a border
+        self.draw_border()
+
+        # Draw header for HUD
+        self.surface.blit(self.header, (BORDER_WIDTH + 10, BORDER_WIDTH))
+
+        # Draw every phase
+        for key, line in enumerate(self.phase_lines):
+            self.surface.blit(line, (BORDER_WIDTH * 6,
+                                     (key + 1) * (self.font.get_linesize() + LINE_SPACING) +
+                                     (BORDER_WIDTH * 4)))
@@ -0,0 +1,108 @@
+'''
+The mapped module holds a map whose layers are memory mapped files, so only
+the parts of the world that have been visited take up memory
+'''
+import mmap
+import os
+import tempfile
+import numpy as np
+
+import constants
+import world
+import chunks
+
+
+class MappedMap(chunks.ChunkGenerator, world.Map):
+    '''
+    A map whose per cell layers are arrays over memory mapped files
+    The files start out sparse, and chunks are generated into them the first
+    time they are streamed in, the same way a ChunkedMap generates them
+    The OS pages the files in and out as the cells are used
+    '''
+
+    def __init__(self, width, height, seed=None, map_dir=None):
+        self.width = width
+        self.height = height
+
+        # Every chunk is generated from the seed and its own key
+        self._init_indexes(seed)
+        self._init_generation()
+
+        # Directory the layer files are kept in
+        self.temp_dir = None
+        if(map_dir is None):
+            self.temp_dir = tempfile.TemporaryDirectory(prefix="tile-game-map-")
+            map_dir = self.temp_dir.name
+        self.map_dir = map_dir
+
+        # Per cell state, indexed [x, y] like the arrays of a Map
+        self.layer_maps = []
+        self.terrain = self.open_layer("terrain")
+        self.transparent = self.open_layer("transparent")
+        self.transparency = self.open_layer("transparency")
+        self.visible = self.open_layer("visible")
+        self.explored = self.open_layer("explored")
+        self.object_ids = self.open_layer("object_ids")
+
+        # Which chunks have been generated into the layers
+        size = constants.CHUNK_SIZE
+        self.generated = np.zeros((-(-width // size), -(-height // size)), dtype=bool)
+
+    def open_layer(self, name):
+        '''
+        Create the file of a layer and map it into memory as an array
+        '''
+        dtype = np.dtype(chunks.LAYERS[name])
+
+        with open(os.path.join(self.map_dir, name + ".dat"), "w+b") as layer_file:
+            # Size the file without writing to it, so it starts out sparse
+            layer_file.truncate(self.width * self.height * dtype.itemsize)
+            layer_map = mmap.mmap(layer_file.fileno(), 0)
+
+        # Cells are used a small window at a time, so don't read around them
+        if(hasattr(mmap, "MADV_RANDOM")):
+            layer_map.madvise(mmap.MADV_RANDOM)
+        self.layer_maps.append(layer_map)
+
+        return np.ndarray((self.width, self.height), dtype=dtype, buffer=layer_map)
+
+    def stream(self, location):
+        '''
+        Make sure every chunk within CHUNK_STREAM_RADIUS of location has been generated
+        '''
+        size = constants.CHUNK_SIZE
+        radius = constants.CHUNK_STREAM_RADIUS
+        x_start = max(location[0] - radius, 0) // size
+        y_start = max(location[1] - radius, 0) // size
+        x_end = (min(location[0] + radius, self.width - 1)) // size + 1
+        y_end = (min(location[1] + radius, self.height - 1)) // size + 1
+
+        for chunk_x, chunk_y in zip(*np.nonzero(~self.generated[x_start:x_end,
+                                                                y_start:y_end])):
+            self.write_chunk(int(chunk_x) + x_start, int(chunk_y) + y_start)
+
+    def write_chunk(self, chunk_x, chunk_y):
+        '''
+        Generate a chunk and write its layers into the mapped files
+        '''
+        size = constants.CHUNK_SIZE
+        chunk = self.generate_chunk(chunk_x, chunk_y)
+
+        # Chunks on the right or bottom edge are cut off by the end of the world
+        x_start = chunk_x * size
+        y_start = chunk_y * size
+        x_end = min(x_start + size, self.width)
+        y_end = min(y_start + size, self.height)
+
+        for name in chunks.LAYERS:
+            getattr(self, name)[x_start:x_end, y_start:y_end] = \
+                chunk.layers[name][:x_end - x_start, :y_end - y_start]
+
+        self.generated[chunk_x, chunk_y] = True
+
+    def flush(self):
+        '''
+        Write every changed page of the layers to their files
+        '''
+        for layer_map in self.layer_maps:
+            layer_map.flush()
@@ -0,0 +1,108 @@
+'''
+The noise module makes smooth random noise for whole areas of cells at once
+Noise is a function of the seed and each cell's position on the map, so any
+area, like a chunk, comes out the same as that part of a bigger area
+'''
+import numpy as np
+
+
+# Keeps the noise keys of a seed apart from its other random streams
+NOISE_SPAWN_KEY = 0x4E015E
+
+# Constants of the lattice hash, from xxHash and SplitMix64
+HASH_X = np.uint64(0x9E3779B97F4A7C15)
+HASH_Y = np.uint64(0xC2B2AE3D27D4EB4F)
+HASH_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+HASH_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+def get_octave_keys(seed, octaves):
+    '''
+    Get a 64 bit key for each octave of noise from a seed of any size
+    '''
+    return np.random.SeedSequence(seed, spawn_key=(NOISE_SPAWN_KEY,)).generate_state(
+        octaves, dtype=np.uint64)
+
+
+def hash_lattice(key, lattice_x, lattice_y):
+    '''
+    Hash lattice points to random values in [0, 1)
+    lattice_x, lattice_y: int arrays, broadcast against each other
+    '''
+    # Casting wraps negative points around, which is fine for a hash
+    res = ((lattice_x.astype(np.uint64) * HASH_X) ^
+           (lattice_y.astype(np.uint64) * HASH_Y) ^
+           key)
+    res ^= res >> np.uint64(30)
+    res *= HASH_MIX_1
+    res ^= res >> np.uint64(27)
+    res *= HASH_MIX_2
+    res ^= res >> np.uint64(31)
+
+    # Keep the top 53 bits, as many as a double holds
+    return (res >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+
+def value_noise(key, x_start, y_start, width, height, scale):
+    '''
+    Value noise over the cells [x_start, x_start + width) x [y_start, y_start + height)
+    Random values on a lattice scale cells apart are smoothly blended between
+    Returns a (width, height) array of values in [0, 1)
+    '''
+    xs = (x_start + np.arange(width)) / scale
+    ys = (y_start + np.arange(height)) / scale
+    x_cells = np.floor(xs).astype(np.int64)
+    y_cells = np.floor(ys).astype(np.int64)
+
+    # Only hash the lattice points around the area
+    lattice = hash_lattice(key,
+                           np.arange(x_cells[0], x_cells[-1] + 2)[:, np.newaxis],
+                           np.arange(y_cells[0], y_cells[-1] + 2)[np.newaxis, :])
+    lattice_x = (x_cells - x_cells[0])[:, np.newaxis]
+    lattice_y = (y_cells - y_cells[0])[np.newaxis, :]
+
+    # Eased position of each cell between its lattice points
+    x_weights = fade(xs - x_cells)[:, np.newaxis]
+    y_weights = fade(ys - y_cells)[np.newaxis, :]
+
+    top = lerp(lattice[lattice_x, lattice_y], lattice[lattice_x + 1, lattice_y], x_weights)
+    bottom = lerp(lattice[lattice_x, lattice_y + 1],
+                  lattice[lattice_x + 1, lattice_y + 1],
+                  x_weights)
+    return lerp(top, bottom, y_weights)
+
+
+def fractal_noise(seed, x_start, y_start, width, height, scale, octaves=4,
+                  persistence=0.5, lacunarity=2.0):
+    '''
+    Sum octaves of value noise, each finer and fainter than the last
+    scale: float, lattice spacing of the first octave in cells
+    persistence: float, amplitude of each octave relative to the last
+    lacunarity: float, how much finer each octave is than the last
+    Returns a (width, height) array of values in [0, 1)
+    '''
+    res = np.zeros((width, height))
+    amplitude = 1.0
+    total_amplitude = 0.0
+
+    for key in get_octave_keys(seed, octaves):
+        res += amplitude * value_noise(key, x_start, y_start, width, height, scale)
+        total_amplitude += amplitude
+        amplitude *= persistence
+        scale /= lacunarity
+
+    return res / total_amplitude
+
+
+def fade(weights):
+    '''
+    Ease weights in [0, 1] so the noise has no creases at lattice points
+    '''
+    return weights * weights * weights * (weights * (weights * 6 - 15) + 10)
+
+
+def lerp(start, end, weights):
+    '''
+    Linearly interpolate between start and end
+    '''
+    return start + (end - start) * weights
@@ -10,24 +10,46 @@ from constants import CELL_WIDTH, CELL_HEIGHT
 class _action:
     '''
     Actions are performed by the player and effect the world
+    Game objects make their actions when asked for them, so actions are
+    compared by what they do rather than by identity
     '''
+    __slots__ = ("location", "text", "destroy_self")
 
     def __init__(self, location, text="No Action Text", destroy_self=False):
         self.location = location
         self.text = text
         self.destroy_self = destroy_self
 
+    def __eq__(self, other):
+        return isinstance(other, _action) and self.get_key() == other.get_key()
+
+    def __hash__(self):
+        return hash(self.get_key())
+
+    def get_key(self):
+        '''
+        Get a tuple of everything that decides what this action does
+        '''
+        return (type(self), self.location, self.text, self.destroy_self)
+
 
 class action_DropObject(_action):
     '''
     Drop Object action
     '''
+    __slots__ = ("obj_to_drop",)
 
     def __init__(self, location, text, obj_to_drop=None, destroy_self=False):
         super(action_DropObject, self).__init__(location, text, destroy_self)
 
         self.obj_to_drop = obj_to_drop
 
+    def get_key(self):
+        '''
+        Get a tuple of everything that decides what this action does
+        '''
+        return super(action_DropObject, self).get_key() + (self.obj_to_drop,)
+
     def act(self):
         '''
         This is called when we actually want to do the action
@@ -35,7 +57,8 @@ class action_DropObject(_action):
         return {
             "location": self.location,
             "success": True,
-            "spawned_objects": [self.obj_to_drop(self.location[0], self.location[1])],
+            # Spawned objects are (object type, location), so the map can create them as entities
+            "spawned_objects": [(self.obj_to_drop, self.location)],
             "destroy_self": self.destroy_self
         }
 
@@ -43,17 +66,46 @@ class action_DropObject(_action):
 class GameObject:
     '''
     Everything in the game that isn't a cell is a game object
+    Only the location is stored per object, what is the same for every object
+    of a type is kept on the class, so there can be many thousands of them
     '''
+    __slots__ = ("location",)
+
+    # Shared by every object of a type, set by each subclass
+    name = "object"
+    color = (255, 0, 255)
+    sprite_name = None
+    transparent = True
 
-    def __init__(self, x, y, color, name):
+    def __init__(self, x, y):
         self.location = (x, y)
-        self.x_pixel = x * CELL_WIDTH
-        self.y_pixel = y * CELL_HEIGHT
 
-        self.name = name
-        self.color = color
-        self.sprite = None
-        self.transparent = True
+    @property
+    def sprite(self):
+        '''
+        The sprite of this object's type, or None
+        '''
+        return SpriteLoader.sprites.get(self.sprite_name)
+
+    @property
+    def actions(self):
+        '''
+        The actions that can be done to this object, made when asked for
+        '''
+        return self.get_actions()
+
+    def get_actions(self):
+        '''
+        Make the actions that can be done to this object
+        '''
+        return self.make_actions(self.location)
+
+    @classmethod
+    def make_actions(cls, location):
+        '''
+        Make the actions that can be done to an object of this type at location
+        '''
+        return []
 
     def get_rect(self):
         '''
@@ -71,39 +123,52 @@ class GameObject:
         '''
 
         # Check if camera has this object in view
-        if(camera.get_rect().contains(self.get_rect())):
-            if(self.sprite and self.sprite.image[0]):
-                surface.blit(self.sprite.image[0],
-                             (self.x_pixel, self.y_pixel))
+        if(camera.contains_cell(self.location)):
+            # The surface only covers the camera's view
+            position = camera.get_surface_position(self.location)
+            sprite = self.sprite
+
+            if(sprite and sprite.image[0]):
+                surface.blit(*sprite.get_blit(position))
             else:
                 pygame.draw.rect(surface,
                                  self.color,
-                                 self.get_rect())
+                                 pygame.Rect(position, (CELL_WIDTH, CELL_HEIGHT)))
 
 
 class Tree(GameObject):
     '''
     A tree
     '''
+    __slots__ = ()
 
-    def __init__(self, x, y):
-        super(Tree, self).__init__(x, y, color=(0, 255, 0), name="tree")
+    name = "tree"
+    color = (0, 255, 0)
+    sprite_name = "tree"
+    transparent = False
 
-        self.sprite = SpriteLoader.sprites.get("tree")
-        self.transparent = False
-        self.actions = [
-            action_DropObject((x, y), "CUT TREE", Wood, destroy_self=True)
-        ]
+    @classmethod
+    def make_actions(cls, location):
+        '''
+        Trees can be cut down into wood
+        '''
+        return [action_DropObject(location, "CUT TREE", Wood, destroy_self=True)]
 
 
 class Wood(GameObject):
     '''
     A wood
     '''
+    __slots__ = ()
+
+    name = "wood"
+    color = (150, 100, 60)
+    sprite_name = "wood"
+    transparent = True
 
-    def __init__(self, x, y):
-        super(Wood, self).__init__(x, y, color=(150, 100, 60), name="wood")
 
-        self.sprite = SpriteLoader.sprites.get("wood")
-        self.transparent = True
-        self.actions = []
+# Object types that can be placed on map cells, by name
+OBJECT_TYPES = {
+    "tree": Tree,
+    "wood": Wood
+}
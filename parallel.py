@@ -0,0 +1,96 @@
+'''
+The parallel module generates the arrays of a world in horizontal bands across
+processes, giving exactly the same result as generating them in one go
+'''
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import world
+
+
+def get_bands(height, bands):
+    '''
+    Split the rows [0, height) into about the given number of (y_start, y_end) bands
+    '''
+    band_height = -(-height // max(bands, 1))
+    return [(y_start, min(y_start + band_height, height))
+            for y_start in range(0, height, band_height)]
+
+
+def roll_band(rng_state, shape, y_start, y_end):
+    '''
+    Roll the rows [y_start, y_end) of what rng.random(shape) would return for
+    a generator in rng_state, without rolling the rest
+    '''
+    width, height = shape
+    bit_generator = np.random.PCG64()
+    bit_generator.state = rng_state
+    rng = np.random.Generator(bit_generator)
+
+    # Each double takes one step of the generator, and the array is filled
+    # one x at a time, so skip to where each x's rows start
+    res = np.empty((width, y_end - y_start))
+    bit_generator.advance(y_start)
+    for x in range(width):
+        res[x] = rng.random(y_end - y_start)
+        bit_generator.advance(height - (y_end - y_start))
+
+    return res
+
+
+def generate_terrain_band(seed, width, y_start, y_end):
+    '''
+    Generate the terrain of the rows [y_start, y_end), see world.generate_terrain
+    '''
+    return world.generate_terrain(seed, 0, y_start, width, y_end - y_start)
+
+
+def grow_forest_band(rng_state, shape, terrain, y_start, y_end, halo_start, density):
+    '''
+    Grow the trees of the rows [y_start, y_end), see Map.generate_forests
+    terrain: array, the terrain of the band and its halo, starting at row halo_start
+    '''
+    halo_end = halo_start + terrain.shape[1]
+    rock = terrain == world.TERRAIN_IDS["rock"]
+    trees = (roll_band(rng_state, shape, halo_start, halo_end) < density) & ~rock
+
+    # Rows past the halo are unknown, so each pass the rows next to them may
+    # come out wrong. The halo is FOREST_PASSES deep, so those never reach the band
+    trees = world.run_forest_automata(trees, rock)
+
+    return trees[:, y_start - halo_start:y_end - halo_start]
+
+
+def generate_terrain(seed, shape, workers):
+    '''
+    Generate terrain like world.generate_terrain, in bands across worker processes
+    '''
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(generate_terrain_band, seed, shape[0], y_start, y_end)
+                   for y_start, y_end in get_bands(shape[1], workers)]
+        return np.concatenate([future.result() for future in futures], axis=1)
+
+
+def grow_forests(rng, terrain, density, workers):
+    '''
+    Grow the tree cells of a map like Map.generate_forests, in bands across
+    worker processes, each band also growing a halo of the rows around it
+    rng is left as if Map.generate_forests had used it
+    Returns a boolean array of the cells with trees
+    '''
+    rng_state = rng.bit_generator.state
+    height = terrain.shape[1]
+    margin = world.FOREST_PASSES
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = []
+        for y_start, y_end in get_bands(height, workers):
+            halo_start = max(y_start - margin, 0)
+            halo_end = min(y_end + margin, height)
+            futures.append(executor.submit(grow_forest_band, rng_state, terrain.shape,
+                                           terrain[:, halo_start:halo_end],
+                                           y_start, y_end, halo_start, density))
+        trees = np.concatenate([future.result() for future in futures], axis=1)
+
+    rng.bit_generator.advance(terrain.shape[0] * terrain.shape[1])
+    return trees
@@ -2,6 +2,7 @@
 Module for handling player operations and info
 '''
 
+import constants
 from objects import GameObject
 
 
@@ -9,12 +10,15 @@ class Player(GameObject):
     '''
     A player in the game, controlled by a user
     '''
+    __slots__ = ("name", "health")
+
+    color = (255, 200, 175)
 
     def __init__(self, x, y):
-        super(Player, self).__init__(x, y, (255, 200, 175), name="Richie")
+        super(Player, self).__init__(x, y)
 
+        self.name = "Richie"
         self.health = 100
-        self.location = (x, y)
 
     def move(self, direction):
         '''
@@ -26,16 +30,9 @@ class Player(GameObject):
         self.location = (x, y)
 
 
-def get_nearby_actions(player, tiles):
+def get_nearby_actions(player, game_map, radius=constants.NEARBY_ACTIONS_RADIUS):
     '''
-    Get the nearby actions for the specified player on the given tiles
+    Get the actions of the objects within radius cells of the specified player,
+    from the action index of the given map
     '''
-    res = []
-    for y in range(player.location[1] - 1, player.location[1] + 2):
-        for x in range(player.location[0] - 1, player.location[0] + 2):
-            neighbor_tile = tiles[x][y]
-            if(neighbor_tile.contains_obj):
-                for action in neighbor_tile.contains_obj.actions:
-                    res.append(action)
-
-    return res
+    return game_map.action_index.query(player.location, radius)
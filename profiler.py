@@ -0,0 +1,137 @@
+'''
+The profiler module times the phases of every frame, keeps rolling
+percentiles of them and writes them to a CSV file
+'''
+import csv
+from collections import deque
+from time import perf_counter_ns
+import numpy as np
+
+import constants
+
+
+# Phases of a frame, in the order they run
+PHASES = ("input", "handle_input", "update_fov", "map_draw", "objects_draw", "huds",
+          "display_update")
+
+# Phases timed inside another phase, left out of the frame total
+NESTED_PHASES = ("update_fov",)
+
+# Short names of the phases and the whole frame for the overlay
+PHASE_LABELS = {
+    "input": "input",
+    "handle_input": "handle",
+    "update_fov": "fov",
+    "map_draw": "map",
+    "objects_draw": "objects",
+    "huds": "huds",
+    "display_update": "display",
+    "frame": "frame"
+}
+
+# Percentiles kept for the overlay
+PERCENTILES = (50, 95)
+
+
+class FrameProfiler:
+    '''
+    Times the phases of each frame with perf_counter_ns
+    Phases that run more than once in a frame are added up, and the frame
+    total is every phase but the nested ones
+    When disabled, start and stop return right away, so the game can always call them
+    '''
+
+    def __init__(self, enabled=False, csv_path=None,
+                 window=constants.PROFILE_WINDOW,
+                 flush_frames=constants.PROFILE_FLUSH_FRAMES):
+        '''
+        csv_path: str, file every frame's timings are appended to, None to keep none
+        window: int, frames the percentiles are taken over
+        flush_frames: int, frames between writes to the CSV file
+        '''
+        self.enabled = enabled
+        self.csv_path = csv_path
+        self.flush_frames = flush_frames
+
+        # Nanoseconds of each phase in the frame being timed
+        self.current = dict.fromkeys(PHASES, 0)
+        # Nanoseconds of each phase and the whole frame, over the last window frames
+        self.history = {phase: deque(maxlen=window) for phase in PHASES + ("frame",)}
+        self.frame_count = 0
+
+        # Rows not written to the CSV file yet
+        self.rows = []
+        self.wrote_header = False
+
+    def start(self):
+        '''
+        Get the time a phase starts at, to pass to stop
+        '''
+        if(not self.enabled):
+            return 0
+        return perf_counter_ns()
+
+    def stop(self, phase, start):
+        '''
+        Add the time since start to a phase of the current frame
+        Returns the time it stopped at, so the next phase can start from it
+        '''
+        if(not self.enabled):
+            return 0
+        now = perf_counter_ns()
+        self.current[phase] += now - start
+        return now
+
+    def end_frame(self):
+        '''
+        Finish timing the current frame, writing the CSV file every flush_frames frames
+        '''
+        if(not self.enabled):
+            return
+
+        frame_time = 0
+        for phase, phase_time in self.current.items():
+            self.history[phase].append(phase_time)
+            if(phase not in NESTED_PHASES):
+                frame_time += phase_time
+        self.history["frame"].append(frame_time)
+
+        if(self.csv_path):
+            self.rows.append([self.frame_count] + list(self.current.values()) + [frame_time])
+
+        self.current = dict.fromkeys(PHASES, 0)
+        self.frame_count += 1
+
+        if(len(self.rows) >= self.flush_frames):
+            self.flush()
+
+    def get_percentiles(self):
+        '''
+        Get {phase: (percentile ms, ...)} of PERCENTILES over the last window
+        frames, for every phase and the whole frame
+        '''
+        res = {}
+        for phase, history in self.history.items():
+            if(history):
+                res[phase] = tuple((np.percentile(np.fromiter(history, dtype=np.int64,
+                                                              count=len(history)),
+                                                  PERCENTILES) / 1e6).tolist())
+            else:
+                res[phase] = (0.0,) * len(PERCENTILES)
+        return res
+
+    def flush(self):
+        '''
+        Append the frames not written yet to the CSV file
+        '''
+        if(not self.csv_path or not self.rows):
+            return
+
+        with open(self.csv_path, "a" if self.wrote_header else "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            if(not self.wrote_header):
+                writer.writerow(["frame"] + [phase + "_ns" for phase in PHASES] + ["frame_ns"])
+                self.wrote_header = True
+            writer.writerows(self.rows)
+
+        self.rows = []
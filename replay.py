@@ -0,0 +1,99 @@
+'''
+The replay module records the inputs of a game so it can be played back exactly
+'''
+import gzip
+import json
+
+
+# Bumped when the recording format changes
+RECORDING_VERSION = 1
+
+
+class InputRecorder:
+    '''
+    Records the input dict of every frame, along with what is needed to create
+    the same world again
+    Runs of frames without input are stored as a single count to keep files small
+    '''
+
+    def __init__(self, seed, chunked_world=False, map_size=None, mapped_world=False):
+        self.seed = seed
+        self.chunked_world = chunked_world
+        self.mapped_world = mapped_world
+        self.map_size = map_size
+
+        # Input dicts, and counts of empty frames in between
+        self.frames = []
+        self.frame_count = 0
+
+    def record(self, inputs):
+        '''
+        Record the inputs of one frame
+        '''
+        self.frame_count += 1
+
+        if(not inputs):
+            # Count the empty frame onto the run before it
+            if(self.frames and isinstance(self.frames[-1], int)):
+                self.frames[-1] += 1
+            else:
+                self.frames.append(1)
+        else:
+            self.frames.append(inputs)
+
+    def save(self, path):
+        '''
+        Write the recording to a gzipped JSON file
+        '''
+        recording = {"version": RECORDING_VERSION,
+                     "seed": self.seed,
+                     "chunked_world": self.chunked_world,
+                     "mapped_world": self.mapped_world,
+                     "map_size": self.map_size,
+                     "frame_count": self.frame_count,
+                     "frames": self.frames}
+
+        with gzip.open(path, "wt", encoding="utf-8") as recording_file:
+            json.dump(recording, recording_file, separators=(",", ":"))
+
+
+class Recording:
+    '''
+    A recording loaded from a file
+    '''
+
+    def __init__(self, path):
+        with gzip.open(path, "rt", encoding="utf-8") as recording_file:
+            recording = json.load(recording_file)
+
+        if(recording.get("version") != RECORDING_VERSION):
+            raise ValueError("Unsupported recording version: " + str(recording.get("version")))
+
+        self.seed = recording["seed"]
+        self.chunked_world = recording["chunked_world"]
+        self.mapped_world = recording.get("mapped_world", False)
+        self.map_size = recording["map_size"] and tuple(recording["map_size"])
+        self.frame_count = recording["frame_count"]
+        self.frames = recording["frames"]
+
+    def get_frames(self):
+        '''
+        Yield the input dict of every recorded frame, in order
+        '''
+        for frame in self.frames:
+            if(isinstance(frame, int)):
+                for _ in range(frame):
+                    yield {}
+            else:
+                yield decode_inputs(frame)
+
+
+def decode_inputs(inputs):
+    '''
+    Turn a recorded input dict back into the format get_inputs returns
+    '''
+    res = dict(inputs)
+    # JSON stores the direction tuple as a list
+    if(res.get("move_player")):
+        res["move_player"] = tuple(res["move_player"])
+    return res
@@ -0,0 +1,88 @@
+'''
+The saves module writes games to disk and reads them back
+A save is one compressed .npz file holding a column per map layer and per
+object property, so saving never walks the map one tile at a time
+'''
+import numpy as np
+
+import world
+import chunks
+from entities import ENTITY_TYPES, TYPE_IDS_BY_NAME
+from player import Player
+
+
+# Bumped when the save format changes
+SAVE_VERSION = 1
+
+
+def save_game(file, game_map, game_player, game_stats):
+    '''
+    Write the map, player and game stats to a file or path
+    '''
+    if(isinstance(game_map, chunks.ChunkGenerator)):
+        raise ValueError("Chunked and mapped worlds can't be saved")
+
+    # Objects occupying cells, as columns
+    object_x, object_y = np.nonzero(game_map.object_ids != world.NO_OBJECT)
+    type_ids = game_map.entities.types[game_map.object_ids[object_x, object_y]]
+
+    # Store each object's type as an index into the saved type names
+    used_type_ids, type_codes = np.unique(type_ids, return_inverse=True)
+    type_names = [ENTITY_TYPES[type_id].name for type_id in used_type_ids.tolist()]
+
+    np.savez_compressed(
+        file,
+        version=SAVE_VERSION,
+        map_size=np.array([game_map.width, game_map.height]),
+        seed=np.array(str(game_map.seed)),
+        terrain=game_map.terrain,
+        explored=game_map.explored,
+        object_x=object_x.astype(np.int32),
+        object_y=object_y.astype(np.int32),
+        object_types=type_codes.astype(np.uint8),
+        object_type_names=np.array(type_names, dtype=str),
+        player_name=np.array(game_player.name),
+        player_location=np.array(game_player.location),
+        player_health=game_player.health,
+        turn_count=game_stats.turn_count,
+        time=np.array(game_stats.time),
+        date_day=game_stats.date[0],
+        date_month=np.array(game_stats.date[1]))
+
+
+def load_game(file, game_stats):
+    '''
+    Read a game saved with save_game from a file or path
+    game_stats: GameStats, set to the saved stats
+    Returns (map, player)
+    '''
+    with np.load(file) as data:
+        if(int(data["version"]) != SAVE_VERSION):
+            raise ValueError("Unsupported save version: " + str(data["version"]))
+
+        # Recreate the map from its layers
+        width, height = data["map_size"].tolist()
+        game_map = world.Map(width, height, seed=int(str(data["seed"])),
+                             terrain=data["terrain"])
+        game_map.explored[:, :] = data["explored"]
+
+        # Recreate the objects, placing a type at a time
+        object_x = data["object_x"]
+        object_y = data["object_y"]
+        object_types = data["object_types"]
+        for code, name in enumerate(data["object_type_names"].tolist()):
+            is_type = object_types == code
+            game_map.add_objects(ENTITY_TYPES[TYPE_IDS_BY_NAME[name]],
+                                 object_x[is_type], object_y[is_type])
+
+        # Recreate the player
+        game_player = Player(*data["player_location"].tolist())
+        game_player.name = str(data["player_name"])
+        game_player.health = int(data["player_health"])
+
+        # Restore the stats
+        game_stats.turn_count = int(data["turn_count"])
+        game_stats.time = tuple(data["time"].tolist())
+        game_stats.date = (int(data["date_day"]), str(data["date_month"]))
+
+    return game_map, game_player
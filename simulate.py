@@ -0,0 +1,130 @@
+'''
+Soak tests the world logic by playing games with a random agent, headless,
+as fast as the turns can be run
+Games with different seeds are independent, so they can be spread across processes
+Run with: python simulate.py [--turns N] [--seeds SEED ...] [--workers N] [--chunked|--mapped]
+'''
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import constants
+import engine
+
+
+# Directions the agent can walk in
+DIRECTIONS = ((0, -1), (-1, 0), (0, 1), (1, 0))
+
+# Chances of the agent picking each kind of input
+ACTION_CHANCE = 0.1
+REST_CHANCE = 0.05
+# Chance of committing the active action, instead of leaving the action menu
+COMMIT_CHANCE = 0.8
+
+
+def get_agent_input(rng, game_engine):
+    '''
+    Pick a random input for a game, in the format get_inputs returns
+    The agent never walks off the map, which the engine doesn't check for
+    '''
+    roll = rng.random()
+
+    # Cut something down, or leave the action menu
+    if(engine.GameEngine.state == "ACTIONS"):
+        if(roll < COMMIT_CHANCE):
+            return {"return": True}
+        return {"toggle_actions": True}
+
+    if(roll < ACTION_CHANCE and game_engine.nearby_actions.has_actions()):
+        return {"toggle_actions": True}
+    if(roll < ACTION_CHANCE + REST_CHANCE):
+        return {"rest": int(rng.integers(1, constants.REST_TURNS + 1))}
+
+    direction = DIRECTIONS[rng.integers(len(DIRECTIONS))]
+    location = game_engine.player.location
+    if(not game_engine.map.in_bounds(location[0] + direction[0], location[1] + direction[1])):
+        return {"rest": 1}
+    return {"move_player": direction}
+
+
+def run_simulation(seed, turns, chunked_world=False, mapped_world=False):
+    '''
+    Play a headless game from a seed with a random agent until it has run
+    the given number of turns
+    Returns a dict of how far it got and how fast
+    '''
+    # The state is shared by every engine in the process
+    engine.GameEngine.state = "GAMEPLAY"
+    game_engine = engine.GameEngine(chunked_world=chunked_world, seed=seed,
+                                    mapped_world=mapped_world, headless=True)
+    game_engine.setup()
+
+    # The agent's rolls come from the seed too, so a game can be played again
+    rng = np.random.default_rng(seed)
+
+    inputs = 0
+    start = time.perf_counter()
+    while(game_engine.game_stats.turn_count < turns):
+        game_engine.handle_input(get_agent_input(rng, game_engine))
+        inputs += 1
+    seconds = max(time.perf_counter() - start, 1e-9)
+
+    return {"seed": seed,
+            "turns": game_engine.game_stats.turn_count,
+            "inputs": inputs,
+            "seconds": seconds,
+            "turns_per_second": game_engine.game_stats.turn_count / seconds,
+            "inputs_per_second": inputs / seconds,
+            "objects": len(game_engine.map.entities),
+            "player_location": game_engine.player.location}
+
+
+def print_result(res):
+    '''
+    Print one game's result as a line
+    '''
+    print("seed " + str(res["seed"]) +
+          ": " + str(res["turns"]) + " turns, " + str(res["inputs"]) + " inputs in " +
+          format(res["seconds"], ".2f") + "s, " +
+          format(res["turns_per_second"], ",.0f") + " turns/s, " +
+          format(res["inputs_per_second"], ",.0f") + " inputs/s, " +
+          str(res["objects"]) + " objects, player at " + str(res["player_location"]))
+
+
+def main():
+    '''
+    Run a game per seed, across processes if asked to, and print the throughput
+    '''
+    parser = argparse.ArgumentParser(description="Soak test the world logic headless")
+    parser.add_argument("--turns", type=int, default=100000, help="turns to run per game")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0],
+                        help="seed of each game, every seed is played once")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes to spread the games across")
+    parser.add_argument("--chunked", action="store_true", help="play on chunked worlds")
+    parser.add_argument("--mapped", action="store_true", help="play on memory mapped worlds")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    games = [(seed, args.turns, args.chunked, args.mapped) for seed in args.seeds]
+
+    if(args.workers > 1):
+        with ProcessPoolExecutor(args.workers) as executor:
+            results = list(executor.map(run_simulation, *zip(*games)))
+    else:
+        results = [run_simulation(*game) for game in games]
+
+    seconds = max(time.perf_counter() - start, 1e-9)
+    for res in results:
+        print_result(res)
+
+    # Throughput over every game, including the time spent creating worlds
+    total_turns = sum(res["turns"] for res in results)
+    print("Total: " + str(total_turns) + " turns in " + format(seconds, ".2f") + "s, " +
+          format(total_turns / seconds, ",.0f") + " turns/s across " +
+          str(min(args.workers, len(games))) + " processes")
+
+
+if __name__ == '__main__':
+    main()
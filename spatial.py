@@ -0,0 +1,137 @@
+'''
+The spatial module indexes game objects by where they are on the map
+'''
+import numpy as np
+
+import constants
+from entities import ENTITY_TYPES, TYPE_HAS_ACTIONS
+
+
+class SpatialIndex:
+    '''
+    Buckets game objects by the square block of cells they are in, so objects
+    can be found by area without looking at every object
+    '''
+
+    def __init__(self, bucket_size=constants.SPATIAL_BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        # Objects by bucket key, each bucket keeps insertion order
+        self.buckets = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for bucket in list(self.buckets.values()):
+            yield from list(bucket)
+
+    def __contains__(self, obj):
+        bucket = self.buckets.get(self.get_key(obj.location))
+        return bucket is not None and obj in bucket
+
+    def get_key(self, location):
+        '''
+        Get the key of the bucket a cell location falls in
+        '''
+        return (location[0] // self.bucket_size, location[1] // self.bucket_size)
+
+    def insert(self, obj):
+        '''
+        Add an object at its current location
+        '''
+        self.buckets.setdefault(self.get_key(obj.location), {})[obj] = None
+        self.count += 1
+
+    def remove(self, obj, location=None):
+        '''
+        Remove an object, from location if given or its current location
+        '''
+        key = self.get_key(location if location else obj.location)
+        bucket = self.buckets[key]
+        del bucket[obj]
+        self.count -= 1
+
+        # Drop empty buckets so they don't pile up as things move around
+        if(not bucket):
+            del self.buckets[key]
+
+    def move(self, obj, old_location):
+        '''
+        Update an object whose location changed from old_location
+        '''
+        self.remove(obj, old_location)
+        self.insert(obj)
+
+    def query(self, x_start, y_start, x_end, y_end):
+        '''
+        Get every object in the cell rectangle [x_start, x_end) x [y_start, y_end)
+        '''
+        res = []
+        if(x_end <= x_start or y_end <= y_start):
+            return res
+
+        for y_key in range(y_start // self.bucket_size, (y_end - 1) // self.bucket_size + 1):
+            for x_key in range(x_start // self.bucket_size, (x_end - 1) // self.bucket_size + 1):
+                bucket = self.buckets.get((x_key, y_key))
+                if(not bucket):
+                    continue
+
+                for obj in bucket:
+                    if(x_start <= obj.location[0] < x_end and
+                       y_start <= obj.location[1] < y_end):
+                        res.append(obj)
+
+        return res
+
+
+class ActionIndex:
+    '''
+    Finds the actions around cells of a map without making views of the objects
+    The cells' object ids and the entities' type ids, kept up to date by
+    spawn_object and add_objects, say which cells hold objects with actions,
+    and each type makes its own actions for a cell
+    '''
+
+    def __init__(self, game_map):
+        self.map = game_map
+
+    def query(self, location, radius):
+        '''
+        Get the actions of every object within radius cells of location, in row order
+        '''
+        # Clamp the area to the map
+        x_start = max(location[0] - radius, 0)
+        y_start = max(location[1] - radius, 0)
+        x_end = min(location[0] + radius + 1, self.map.width)
+        y_end = min(location[1] + radius + 1, self.map.height)
+        if(x_end <= x_start or y_end <= y_start):
+            return []
+
+        # Occupied cells in row order, entity ids are row indexes so empty cells are negative
+        object_ids = np.asarray(self.map.object_ids[x_start:x_end, y_start:y_end]).T
+        ys, xs = np.nonzero(object_ids >= 0)
+
+        # Keep the cells whose object's type has actions
+        type_ids = self.map.entities.types[object_ids[ys, xs]]
+        has_actions = TYPE_HAS_ACTIONS[type_ids]
+
+        # Each type makes the actions of its objects for their cell
+        located = [((y + y_start, x + x_start),
+                    ENTITY_TYPES[type_id].make_actions((x + x_start, y + y_start)))
+                   for x, y, type_id in zip(xs[has_actions].tolist(), ys[has_actions].tolist(),
+                                            type_ids[has_actions].tolist())]
+
+        # Game objects not occupying a cell, like the player, go between them by location
+        others = [((obj.location[1], obj.location[0]), obj.actions)
+                  for obj in self.map.objects.query(x_start, y_start, x_end, y_end)]
+        others = [entry for entry in others if(entry[1])]
+        if(others):
+            located.extend(others)
+            located.sort(key=lambda entry: entry[0])
+
+        res = []
+        for _, actions in located:
+            res.extend(actions)
+
+        return res
@@ -2,10 +2,16 @@
 World module handles creating a map, map operations, all that stuff
 '''
 import random
+import numpy as np
 import pygame
 import constants
-from graphics import SpriteLoader
+import noise
+import parallel
+from graphics import SpriteLoader, FOG_BRIGHTNESS
 from objects import Tree
+from entities import EntityStore, ENTITY_TYPES
+from spatial import SpatialIndex, ActionIndex
+from fov import FovCache
 from util import clamp
 
 
@@ -14,73 +20,417 @@ TERRAIN_COLORS = {
     "rock": (130, 140, 160)
 }
 
+# Terrain ids stored in the map arrays, indexed by id
+TERRAIN_NAMES = ("snow", "rock")
+TERRAIN_IDS = {name: index for index, name in enumerate(TERRAIN_NAMES)}
+
+# Base transparency of every terrain, indexed by terrain id
+TERRAIN_TRANSPARENCY = np.array([True, True], dtype=bool)
+
+# Value in the object id array for cells with no object
+NO_OBJECT = -1
+
+# Terrain noise, see generate_terrain
+TERRAIN_NOISE_SCALE = 16  # IN CELLS, BETWEEN LATTICE POINTS OF THE FIRST OCTAVE
+TERRAIN_NOISE_OCTAVES = 4
+# Noise at or above this is rock, which makes about 15% of cells rock
+ROCK_HEIGHT = 0.65
+
+# Forest generation
+# The clumps of rock leave wide open snow, where the automata spread trees
+# quickly, so these start sparse to end with trees on about 35% of cells
+FOREST_DENSITY = 0.22
+FOREST_PASSES = 5
+# Every cell updates at once in generate_forests, which grows fewer trees
+# than updating tiles in place, so it starts denser to end at the same density
+FOREST_DENSITY_VECTORIZED = 0.27
+
+# Fill for explored tiles out of view with no sprite
+NO_SPRITE_FOG_COLOR = (FOG_BRIGHTNESS, 0, FOG_BRIGHTNESS)
+
 CURRENT_MAP = None
 
 
 class Map:
     '''
-    The playable game map made up of tiles
+    The playable game map, stored as one dense array per cell property
     '''
 
-    def __init__(self, width, height):
+    def __init__(self, width, height, seed=None, terrain=None, workers=1):
+        '''
+        seed: int, the seed every random roll comes from, random if None
+        terrain: array, the terrain id of every cell, rolled from the seed if None
+        workers: int, processes to roll the terrain across
+        '''
         self.width = width
         self.height = height
-        self.tiles = [[Tile(x, y) for y in range(height)]
-                      for x in range(width)]
 
-    def generate_forests(self, objects):
+        # Pick the seed, and create the entity store and indexes
+        self._init_indexes(seed)
+
+        # Every random roll for this map comes from this generator
+        self.rng = np.random.default_rng(self.seed)
+
+        # Generate the terrain for the whole map at once
+        if(terrain is None and workers > 1):
+            terrain = parallel.generate_terrain(self.seed, (width, height), workers)
+        elif(terrain is None):
+            terrain = generate_terrain(self.seed, 0, 0, width, height)
+        self.terrain = terrain
+
+        # Per cell state, indexed [x, y]
+        self.transparent = TERRAIN_TRANSPARENCY[self.terrain]
+        # Transparency of terrain and occupying objects together, kept up to
+        # date as objects are set so FOV can slice it directly
+        self.transparency = self.transparent.copy()
+        self.visible = np.zeros((width, height), dtype=bool)
+        self.explored = np.zeros((width, height), dtype=bool)
+
+        # Objects occupying cells are entities, referenced by entity id
+        self.object_ids = np.full((width, height), NO_OBJECT, dtype=np.int32)
+
+    def _init_indexes(self, seed):
+        '''
+        Pick the seed and create the entity store and the indexes over the
+        map's layers, shared by every kind of map
+        seed: int, the seed every random roll comes from, random if None
+        '''
+        # Pick a seed if none was given, so the map can be generated again
+        if(seed is None):
+            seed = np.random.SeedSequence().entropy
+        self.seed = seed
+
+        # Objects occupying cells, referenced by the entity ids in object_ids
+        self.entities = EntityStore()
+
+        # Game objects not occupying a cell, like the player
+        self.objects = SpatialIndex()
+
+        # Actions around cells, found from the object ids and entity types
+        self.action_index = ActionIndex(self)
+
+        # Recent field of view results, kept as transparency changes
+        self.fov_cache = FovCache()
+
+        # Tile views, indexed tiles[x][y]
+        self.tiles = TileGrid(self)
+
+    def in_bounds(self, x, y):
+        '''
+        Check if the cell (x, y) is on the map
+        '''
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def stream(self, location):
+        '''
+        Make sure the cells around location are ready to use
+        Every cell of a Map is always ready, so this does nothing
+        '''
+
+    def get_tile(self, x, y):
+        '''
+        Get a Tile view of the cell at (x, y)
+        '''
+        return Tile(self, x, y)
+
+    def get_object(self, x, y):
+        '''
+        Get a view of the object occupying the cell at (x, y), or None
+        '''
+        object_id = self.object_ids[x, y]
+        if(object_id == NO_OBJECT):
+            return None
+        return self.entities.get_view(object_id)
+
+    def get_objects_in(self, x_start, y_start, x_end, y_end):
+        '''
+        Get every object in the given cell rectangle, occupying a cell or not
+        '''
+        x_start, x_end = clamp(x_start, 0, self.width), clamp(x_end, 0, self.width)
+        y_start, y_end = clamp(y_start, 0, self.height), clamp(y_end, 0, self.height)
+        res = []
+        if(x_start < x_end and y_start < y_end):
+            object_ids = self.object_ids[x_start:x_end, y_start:y_end]
+            res = [self.entities.get_view(object_id)
+                   for object_id in object_ids[object_ids != NO_OBJECT].tolist()]
+
+        return res + self.objects.query(x_start, y_start, x_end, y_end)
+
+    def set_object(self, x, y, obj):
+        '''
+        Set the object occupying the cell at (x, y), None to clear it
+        Only the object's type is kept, as a new entity
+        '''
+        self.spawn_object(x, y, type(obj) if obj is not None else None)
+
+    def spawn_object(self, x, y, object_type):
+        '''
+        Create an entity of an object type occupying the cell at (x, y),
+        destroying the current occupant, None to only clear the cell
+        '''
+        # Release the current occupant
+        object_id = self.object_ids[x, y]
+        if(object_id != NO_OBJECT):
+            self.entities.destroy(object_id)
+            self.object_ids[x, y] = NO_OBJECT
+
+        if(object_type is not None):
+            self.object_ids[x, y] = self.entities.create(object_type, x, y)
+
+        self.update_transparency(x, y)
+        self.fov_cache.update((x, y))
+
+    def update_transparency(self, x, y):
+        '''
+        Recompute the combined transparency of the cell at (x, y)
+        '''
+        object_id = self.object_ids[x, y]
+        self.transparency[x, y] = (self.transparent[x, y] and
+                                   (object_id == NO_OBJECT or
+                                    self.entities.transparent[object_id]))
+
+    def generate_forests(self, objects=None, density=FOREST_DENSITY_VECTORIZED, workers=1):
         '''
         Use cellular automata to generate some forests
+        Neighbours are counted for the whole map at once, and trees are only
+        created after the final pass
+        objects: list, optionally extended with the created trees
+        density: float, chance of each cell starting with a tree
+        workers: int, processes to grow the forests across, the trees are the same
+        '''
+        if(workers > 1):
+            trees = parallel.grow_forests(self.rng, self.terrain, density, workers)
+        else:
+            rock = self.terrain == TERRAIN_IDS["rock"]
+
+            # Create random tree cells
+            trees = (self.rng.random((self.width, self.height)) < density) & ~rock
+
+            # Using cellular automata
+            trees = run_forest_automata(trees, rock)
+
+        # Create the trees and place them in one go
+        xs, ys = np.nonzero(trees)
+        self.add_objects(Tree, xs, ys)
+
+        if(objects is not None):
+            objects.extend(Tree(x, y) for x, y in zip(xs.tolist(), ys.tolist()))
+
+    def add_objects(self, object_type, xs, ys):
         '''
+        Create an entity of an object type on each of many empty cells at once
+        xs, ys: arrays, the cell of each entity
+        '''
+        self.object_ids[xs, ys] = self.entities.create_many(object_type, xs, ys)
+        self.fov_cache.clear()
+
+        # Objects that aren't transparent block sight
+        if(object_type.transparent is False):
+            self.transparency[xs, ys] = False
+
+    def generate_forests_iterative(self, objects):
+        '''
+        Use cellular automata to generate some forests, one tile at a time
+        The original generator, kept to compare against generate_forests
+        '''
+        rock = TERRAIN_IDS["rock"]
+
         # Create random tree tiles
-        for y in range(constants.MAP_HEIGHT):
-            for x in range(constants.MAP_WIDTH):
-                if(random.random() < 0.3 and self.tiles[x][y].terrain != "rock"):
-                    self.tiles[x][y].contains_obj = Tree(x, y)
-                    objects.append(self.tiles[x][y].contains_obj)
+        for y in range(self.height):
+            for x in range(self.width):
+                if(random.random() < FOREST_DENSITY and self.terrain[x, y] != rock):
+                    self.spawn_object(x, y, Tree)
 
         # Using cellular automata
         # 5 passes are done
-        for _ in range(5):
-            for y in range(constants.MAP_HEIGHT):
-                for x in range(constants.MAP_WIDTH):
-                    current_tile = self.tiles[x][y]
-                    neighbors = get_tile_neighbors(current_tile)
+        for _ in range(FOREST_PASSES):
+            for y in range(self.height):
+                for x in range(self.width):
                     tree_neighbors = 0
 
-                    for neighbor in neighbors:
-                        if(has_tree(self.tiles[neighbor[0]][neighbor[1]])):
+                    for neighbor in get_cell_neighbors((x, y), self.width, self.height):
+                        if(self.has_tree(neighbor[0], neighbor[1])):
                             tree_neighbors += 1
 
-                    if(not has_tree(current_tile) and tree_neighbors > 3 and current_tile.terrain != "rock"):
-                        current_tile.contains_obj = Tree(x, y)
-                        objects.append(self.tiles[x][y].contains_obj)
-                    elif(has_tree(current_tile) and tree_neighbors < 2):
-                        objects.remove(self.tiles[x][y].contains_obj)
-                        current_tile.contains_obj = None
+                    if(not self.has_tree(x, y) and tree_neighbors > 3 and self.terrain[x, y] != rock):
+                        self.spawn_object(x, y, Tree)
+                    elif(self.has_tree(x, y) and tree_neighbors < 2):
+                        self.spawn_object(x, y, None)
+
+        # Views of the trees that are left
+        xs, ys = np.nonzero(self.object_ids != NO_OBJECT)
+        objects.extend(Tree(x, y) for x, y in zip(xs.tolist(), ys.tolist()))
+
+    def has_tree(self, x, y):
+        '''
+        Check if the cell at (x, y) has a tree on it
+        '''
+        object_id = self.object_ids[x, y]
+        return object_id != NO_OBJECT and self.entities.get_object_type(object_id) is Tree
 
     def draw(self, surface, camera):
         '''
-        Draw the map cells
+        Draw the map cells, batching every sprite into one Surface.blits() call
         '''
-        for y_tile in range(camera.location[1] - 1, (camera.location[1] + 2) + constants.CAMERA_HEIGHT_CELL):
-            for x_tile in range(camera.location[0] - 1, (camera.location[0] + 2) + constants.CAMERA_WIDTH_CELL):
-                self.tiles[x_tile][y_tile].draw(surface)
+        x_start = max(camera.location[0] - 1, 0)
+        x_end = min(camera.location[0] + 2 + constants.CAMERA_WIDTH_CELL, self.width)
+        y_start = max(camera.location[1] - 1, 0)
+        y_end = min(camera.location[1] + 2 + constants.CAMERA_HEIGHT_CELL, self.height)
+
+        # Read the window out of the map in one go
+        visible = self.visible[x_start:x_end, y_start:y_end]
+        explored = self.explored[x_start:x_end, y_start:y_end]
+        terrain = self.terrain[x_start:x_end, y_start:y_end]
+
+        # Sprites by terrain id
+        sprites = [SpriteLoader.sprites.get(name) for name in TERRAIN_NAMES]
+
+        # Only cells that have been seen are drawn
+        xs, ys = np.nonzero(visible | explored)
+        blits = []
+        for x, y, cell_visible, terrain_id in zip(xs.tolist(),
+                                                  ys.tolist(),
+                                                  visible[xs, ys].tolist(),
+                                                  terrain[xs, ys].tolist()):
+            position = camera.get_surface_position((x + x_start, y + y_start))
+            sprite = sprites[terrain_id]
+
+            if(sprite):
+                # Use the darkened sprite if explored but not visible
+                blits.append(sprite.get_blit(position, fogged=not cell_visible))
+            else:
+                # No sprite
+                surface.fill((255, 0, 255) if cell_visible else NO_SPRITE_FOG_COLOR,
+                             pygame.Rect(position, (constants.CELL_WIDTH, constants.CELL_HEIGHT)))
+
+        surface.blits(blits, doreturn=False)
+
+    def draw_objects(self, surface, camera):
+        '''
+        Draw the visible objects occupying cells, batching every sprite into
+        one Surface.blits() call
+        '''
+        x_start, y_start = camera.location
+        x_end = min(x_start + constants.CAMERA_WIDTH_CELL + 2, self.width)
+        y_end = min(y_start + constants.CAMERA_HEIGHT_CELL + 2, self.height)
+
+        # Read the window out of the map in one go
+        object_ids = self.object_ids[x_start:x_end, y_start:y_end]
+        xs, ys = np.nonzero((object_ids != NO_OBJECT) &
+                            self.visible[x_start:x_end, y_start:y_end])
+
+        # Sprites by type id
+        object_types = ENTITY_TYPES
+        sprites = [SpriteLoader.sprites.get(object_type.sprite_name)
+                   for object_type in object_types]
+
+        blits = []
+        for x, y, type_id in zip(xs.tolist(), ys.tolist(),
+                                 self.entities.types[object_ids[xs, ys]].tolist()):
+            position = camera.get_surface_position((x + x_start, y + y_start))
+            sprite = sprites[type_id]
+
+            if(sprite):
+                blits.append(sprite.get_blit(position))
+            else:
+                # No sprite
+                surface.fill(object_types[type_id].color,
+                             pygame.Rect(position, (constants.CELL_WIDTH, constants.CELL_HEIGHT)))
+
+        surface.blits(blits, doreturn=False)
+
+
+class TileGrid:
+    '''
+    Indexable as tiles[x][y], hands out Tile views over a Map
+    '''
+
+    class Column:
+        '''
+        A single x column of the grid
+        '''
+
+        def __init__(self, game_map, x):
+            self.map = game_map
+            self.x = x
+
+        def __getitem__(self, y):
+            return Tile(self.map, self.x, y)
+
+    def __init__(self, game_map):
+        self.map = game_map
+
+    def __getitem__(self, x):
+        return self.Column(self.map, x)
 
 
 class Tile:
     '''
-    Tiles occupy cells on the game board, make up the map
+    Tiles occupy cells on the game board, a view over one cell of a Map
     '''
 
-    def __init__(self, x, y):
+    def __init__(self, game_map, x, y):
+        self.map = game_map
         self.location = (x, y)
-        self.terrain = "snow" if random.random() < 0.85 else "rock"
-        self.contains_obj = None
-        self.transparent = True
-        self.visible = True
-        self.explored = False
-        self.sprite = SpriteLoader.sprites.get(self.terrain)
+
+    @property
+    def terrain(self):
+        '''
+        The terrain name of this tile
+        '''
+        return TERRAIN_NAMES[self.map.terrain[self.location]]
+
+    @property
+    def sprite(self):
+        '''
+        The sprite of this tile's terrain
+        '''
+        return SpriteLoader.sprites.get(self.terrain)
+
+    @property
+    def contains_obj(self):
+        '''
+        The object occupying this tile, or None
+        '''
+        return self.map.get_object(*self.location)
+
+    @contains_obj.setter
+    def contains_obj(self, obj):
+        self.map.set_object(self.location[0], self.location[1], obj)
+
+    @property
+    def transparent(self):
+        '''
+        If the terrain of this tile can be seen through
+        '''
+        return bool(self.map.transparent[self.location])
+
+    @transparent.setter
+    def transparent(self, value):
+        self.map.transparent[self.location] = value
+        self.map.update_transparency(*self.location)
+
+    @property
+    def visible(self):
+        '''
+        If this tile is in the player's field of view
+        '''
+        return bool(self.map.visible[self.location])
+
+    @visible.setter
+    def visible(self, value):
+        self.map.visible[self.location] = value
+
+    @property
+    def explored(self):
+        '''
+        If this tile has ever been seen
+        '''
+        return bool(self.map.explored[self.location])
+
+    @explored.setter
+    def explored(self, value):
+        self.map.explored[self.location] = value
 
     def get_rect(self):
         '''
@@ -95,30 +445,25 @@ class Tile:
         '''
         Check if this tile is currently transparent or not
         '''
-        if(self.contains_obj and self.contains_obj.transparent is False):
-            return False
-
-        return self.transparent
+        return bool(self.map.transparency[self.location])
 
-    def draw(self, surface):
+    def draw(self, surface, camera):
         '''
-        Draw this tile on the specified surface
+        Draw this tile on the specified camera sized surface
         '''
-        if(self.visible or self.explored):
-            if(self.sprite and self.sprite.image[0]):
-                # We have a sprite
-                surface.blit(self.sprite.image[0], self.get_rect().topleft)
+        visible = self.visible
+        explored = self.explored
+        rect = pygame.Rect(camera.get_surface_position(self.location),
+                           (constants.CELL_WIDTH, constants.CELL_HEIGHT))
+
+        if(visible or explored):
+            sprite = self.sprite
+            if(sprite and sprite.image[0]):
+                # We have a sprite, use the darkened one if explored but not visible
+                surface.blit(*sprite.get_blit(rect.topleft, fogged=not visible))
             else:
                 # No sprite
-                surface.fill((255, 0, 255), self.get_rect())
-
-        # Check if this tile is not visible and explored
-        if(not self.visible and self.explored):
-            # Make darker
-            overlay = pygame.Surface((self.get_rect().width,
-                                      self.get_rect().height))
-            overlay.fill((0, 0, 0, 205))
-            surface.blit(overlay, self.get_rect().topleft)
+                surface.fill((255, 0, 255) if visible else NO_SPRITE_FOG_COLOR, rect)
 
 
 class Camera:
@@ -126,8 +471,10 @@ class Camera:
     Controls what things are rendered
     '''
 
-    def __init__(self, x, y):
+    def __init__(self, x, y, map_width=constants.MAP_WIDTH, map_height=constants.MAP_HEIGHT):
         self.location = (x, y)
+        self.map_width = map_width
+        self.map_height = map_height
 
     def center_at(self, location):
         '''
@@ -151,18 +498,47 @@ class Camera:
                            (constants.CAMERA_WIDTH + (2 * constants.CELL_WIDTH)),
                            (constants.CAMERA_HEIGHT + (2 * constants.CELL_HEIGHT)))
 
+    def contains_cell(self, location):
+        '''
+        Check if a whole cell is inside the rectangle from get_rect()
+        '''
+        x = location[0] - self.location[0]
+        y = location[1] - self.location[1]
+        return (0 <= x <= (constants.CAMERA_WIDTH + constants.CELL_WIDTH) // constants.CELL_WIDTH and
+                0 <= y <= (constants.CAMERA_HEIGHT + constants.CELL_HEIGHT) // constants.CELL_HEIGHT)
+
+    def get_surface_position(self, location):
+        '''
+        Return the pixel position of a cell on a surface the size of get_rect()
+        '''
+        return ((location[0] - self.location[0]) * constants.CELL_WIDTH,
+                (location[1] - self.location[1]) * constants.CELL_HEIGHT)
+
     def set_cell(self, coords):
         '''
         Set the X cell and Y cell location of the camera's top left point
         '''
 
         x = clamp(coords[0], 0,
-                  constants.MAP_WIDTH - constants.CAMERA_WIDTH_CELL)
+                  self.map_width - constants.CAMERA_WIDTH_CELL)
         y = clamp(coords[1], 0,
-                  constants.MAP_HEIGHT - constants.CAMERA_HEIGHT_CELL)
+                  self.map_height - constants.CAMERA_HEIGHT_CELL)
         self.location = (x, y)
 
 
+def generate_terrain(seed, x_start, y_start, width, height):
+    '''
+    Generate the terrain ids of the cells [x_start, x_start + width) x
+    [y_start, y_start + height) from the seed's noise
+    Any area comes out the same as that part of a bigger area, so chunks line up
+    '''
+    heights = noise.fractal_noise(seed, x_start, y_start, width, height,
+                                  TERRAIN_NOISE_SCALE, TERRAIN_NOISE_OCTAVES)
+    return np.where(heights < ROCK_HEIGHT,
+                    TERRAIN_IDS["snow"],
+                    TERRAIN_IDS["rock"]).astype(np.uint8)
+
+
 def get_tile_neighbors(tile):
     '''
     Get all the neighboring coordinates for the specified tile
@@ -174,18 +550,25 @@ def get_tile_neighbors(tile):
                         "' expected type '" +
                         Tile.__name__ + "'")
 
+    return get_cell_neighbors(tile.location)
+
+
+def get_cell_neighbors(location, width=constants.MAP_WIDTH, height=constants.MAP_HEIGHT):
+    '''
+    Get all the neighboring coordinates for the specified cell location
+    '''
     res = []
 
     for y in range(3):
         for x in range(3):
-            new_x = (tile.location[0] - 1) + x
-            new_y = (tile.location[1] - 1) + y
+            new_x = (location[0] - 1) + x
+            new_y = (location[1] - 1) + y
 
-            if(new_x < 0 or new_x > constants.MAP_WIDTH - 1):
+            if(new_x < 0 or new_x > width - 1):
                 continue
-            if(new_y < 0 or new_y > constants.MAP_HEIGHT - 1):
+            if(new_y < 0 or new_y > height - 1):
                 continue
-            if(new_x == tile.location[0] and new_y == tile.location[1]):
+            if(new_x == location[0] and new_y == location[1]):
                 continue
 
             res.append((new_x, new_y))
@@ -193,6 +576,38 @@ def get_tile_neighbors(tile):
     return res
 
 
+def count_neighbors(cells):
+    '''
+    Count the set neighbours of every cell in a 2d boolean array
+    Cells off the edge of the array count as unset
+    '''
+    padded = np.pad(cells, 1).astype(np.uint8)
+    width, height = cells.shape
+
+    counts = np.zeros((width, height), dtype=np.uint8)
+    for x_offset in range(3):
+        for y_offset in range(3):
+            if(x_offset == 1 and y_offset == 1):
+                continue
+            counts += padded[x_offset:x_offset + width, y_offset:y_offset + height]
+
+    return counts
+
+
+def run_forest_automata(trees, rock, passes=FOREST_PASSES):
+    '''
+    Run the forest cellular automata over a 2d boolean array of trees
+    Empty cells with more than 3 tree neighbours grow a tree unless they are
+    rock, and trees with less than 2 tree neighbours die
+    '''
+    for _ in range(passes):
+        tree_neighbors = count_neighbors(trees)
+        trees = ((trees & (tree_neighbors >= 2)) |
+                 (~trees & (tree_neighbors > 3) & ~rock))
+
+    return trees
+
+
 def has_tree(tile):
     '''Check if tile has a tree on it'''
     if(tile.contains_obj):